@@ -2,15 +2,54 @@ import eventlet
 eventlet.monkey_patch()  # Socket.io uchun eng tepada bo'lishi shart
 
 import os
+import re
+import time
+import atexit
+import threading
 import secrets
+import io
+import gzip
 import json
-from datetime import datetime
-from flask import Flask, request, jsonify, send_from_directory
+import base64
+import binascii
+import sqlite3
+import hashlib
+import functools
+import contextlib
+import mimetypes
+import random
+import logging
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta, timezone
+from flask import Flask, Response, request, jsonify, send_from_directory, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex, CreateTable
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
+from socketio import PubSubManager
+from werkzeug.http import http_date, parse_range_header
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
 from werkzeug.security import generate_password_hash, check_password_hash
+from eventlet import tpool
+
+try:
+    from PIL import Image, ImageOps  # avatar variantlari uchun (ixtiyoriy)
+except ImportError:
+    Image = None
+
+try:
+    import brotli  # statik fayllarni br bilan siqish uchun (ixtiyoriy)
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl  # migratsiyalarni workerlar orasida navbatlash uchun (Windows da yo'q)
+except ImportError:
+    fcntl = None
 
 # --- KONFIGURATSIYA ---
 app = Flask(__name__)
@@ -25,15 +64,408 @@ app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50 MB maksimal
 app.config['REELS_UPLOAD_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'reels')
 
+# Chat tarixi sahifalari (/api/messages?before_id=..&limit=..)
+app.config['MESSAGES_PAGE_SIZE'] = int(os.environ.get('MESSAGES_PAGE_SIZE', 50))
+app.config['MESSAGES_PAGE_MAX'] = 200
+
+# Xabarlarni saqlash: 'batch' (group commit) yoki 'sync' (har biri alohida commit)
+app.config['MESSAGE_WRITE_MODE'] = os.environ.get('MESSAGE_WRITE_MODE', 'batch')
+app.config['MESSAGE_BATCH_SIZE'] = 200
+app.config['MESSAGE_BATCH_DELAY'] = 0.005  # sekund
+
+# Xonaga yetkazishni to'plash: 'off', 'group' (faqat guruhlar) yoki 'all'.
+# Yoqilganda xabarlar xonaga bittalab 'receive_message' emas, ROOM_BATCH_DELAY
+# ichida yig'ilgan 'receive_messages' ro'yxati sifatida ketadi.
+app.config['ROOM_BATCH_MODE'] = os.environ.get('ROOM_BATCH_MODE', 'off')
+app.config['ROOM_BATCH_DELAY'] = float(os.environ.get('ROOM_BATCH_DELAY', 0.05))  # sekund
+app.config['ROOM_BATCH_SIZE'] = int(os.environ.get('ROOM_BATCH_SIZE', 100))
+
+# Onlayn holat: heartbeat kelmasa sessiya yopiladi; o'zgarishlar to'plab yuboriladi
+app.config['PRESENCE_TIMEOUT'] = 90  # sekund
+app.config['PRESENCE_FLUSH_INTERVAL'] = 2  # sekund
+
+# Typing indikatori: 'typing_stop' kelmasa holat qancha yashaydi va yuborish oralig'i
+app.config['TYPING_TIMEOUT'] = 6  # sekund
+app.config['TYPING_FLUSH_INTERVAL'] = 0.5  # sekund
+
+# Bloklar keshi: nechta foydalanuvchining ro'yxati xotirada saqlanadi va qancha vaqt
+app.config['BLOCK_CACHE_SIZE'] = 10000
+app.config['BLOCK_CACHE_TTL'] = 60  # sekund
+
+# Profil hisoblagichlarini davriy qayta hisoblash (0 - o'chirilgan)
+app.config['COUNTERS_RECONCILE_INTERVAL'] = int(os.environ.get('COUNTERS_RECONCILE_INTERVAL', 3600))
+
+# Guruhlar katalogi keshi (boshqa workerlardagi o'zgarishlar uchun ham chegara)
+app.config['ENTITY_CACHE_TTL'] = 30  # sekund
+
+# Foydalanuvchining guruh xonalari keshi (socket 'join' uchun)
+app.config['ROOM_CACHE_SIZE'] = 20000
+app.config['ROOM_CACHE_TTL'] = 300  # sekund
+
+# Admin statistikasi: admin socketlarga o'zgarishlarni yuborish va COUNT bilan tekshirish oralig'i
+app.config['STATS_PUSH_INTERVAL'] = 2  # sekund
+app.config['STATS_RECONCILE_INTERVAL'] = 300  # sekund
+
+# Post ko'rishlarini bazaga yozish va 'update_views' yuborish oralig'i
+app.config['VIEW_FLUSH_INTERVAL'] = float(os.environ.get('VIEW_FLUSH_INTERVAL', 2))
+
+# News feed sahifasi hajmi (/api/news-feed?cursor=..&limit=..)
+app.config['FEED_PAGE_SIZE'] = 20
+
+# Bo'laklab yuklash: vaqtinchalik .part fayllar va kontent-manzilli (sha256) ombor
+app.config['UPLOAD_TMP_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'tmp')
+app.config['CAS_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'cas')
+app.config['UPLOAD_MAX_SIZE'] = 2 * 1024 * 1024 * 1024  # 2 GB (butun fayl)
+app.config['UPLOAD_SESSION_TTL'] = 24 * 3600  # sekund
+
+# Avatar variantlarini yasaydigan fon vazifalari soni (har biri tpool threadida ishlaydi)
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))
+
+# Parol xeshlash: bir vaqtda nechta thread, nechta so'rov navbatda kuta oladi va qancha
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', 64))
+app.config['PASSWORD_HASH_WAIT'] = 5  # sekund
+
+# Sessiya tokenlari: amal qilish muddati va jarayon ichidagi kesh
+app.config['SESSION_TTL'] = 30 * 24 * 3600  # sekund
+app.config['SESSION_CACHE_SIZE'] = 50000
+app.config['SESSION_CACHE_TTL'] = 60  # sekund (boshqa workerdagi bekor qilish shu vaqtda ko'rinadi)
+# True bo'lsa, tokensiz so'rovlar so'rov tanasidagi username bilan ishlamaydi
+app.config['SESSION_REQUIRED'] = os.environ.get('SESSION_REQUIRED', '') == '1'
+
+# Fondagi o'chirish: bitta tranzaksiyada nechta qator va to'plamlar orasidagi pauza
+app.config['DELETE_BATCH_SIZE'] = 500
+app.config['DELETE_BATCH_PAUSE'] = 0.05  # sekund
+app.config['DELETE_JOB_STALE'] = 300  # sekund: shuncha yangilanmagan 'running' vazifa qayta olinadi
+app.config['DELETE_JOB_RETENTION'] = 24 * 3600  # sekund: tugagan vazifa /api/deletions da shuncha ko'rinadi
+
+# Loglar: daraja va issiq yo'ldagi (har so'rovdagi) xabarlarning qancha qismi yoziladi
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO').upper()
+app.config['LOG_SAMPLE_RATE'] = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
+
+# Metrikalar: hub kechikishini o'lchash oralig'i
+app.config['HUB_LAG_INTERVAL'] = 0.5  # sekund
+
+# Qidiruv: SQLite FTS5 indeksi ('0' bo'lsa LIKE bo'yicha, benchmark uchun)
+app.config['SEARCH_FTS'] = os.environ.get('SEARCH_FTS', '1') != '0'
+
 # Ruxsat etilgan video formatlari (Reels uchun)
 ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'webm'}
+ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+ALLOWED_AUDIO_EXTENSIONS = {'mp3', 'm4a', 'ogg', 'oga', 'opus', 'wav', 'webm'}
+ALLOWED_DOCUMENT_EXTENSIONS = {'pdf', 'txt', 'zip', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx'}
+# Bo'laklab yuklash turlari va har biriga ruxsat etilgan kengaytmalar (html, svg, js yo'q)
+UPLOAD_KINDS = {
+    'avatar': ALLOWED_IMAGE_EXTENSIONS,
+    'reel': ALLOWED_EXTENSIONS,
+    'media': ALLOWED_IMAGE_EXTENSIONS | ALLOWED_EXTENSIONS | ALLOWED_AUDIO_EXTENSIONS | ALLOWED_DOCUMENT_EXTENSIONS,
+}
 
 # Papkalarni yaratish
 os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'media'), exist_ok=True)
 os.makedirs(app.config['REELS_UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['UPLOAD_TMP_FOLDER'], exist_ok=True)
+os.makedirs(app.config['CAS_FOLDER'], exist_ok=True)
+
+# --- SOCKET.IO XABAR SHINASI (BIR NECHTA WORKER UCHUN) ---
+# Xonalar har bir jarayon xotirasida saqlanadi. Bir nechta gunicorn worker
+# ishlaganda emit va xonalarga tarqatish umumiy shina orqali o'tishi kerak.
+# SOCKETIO_MESSAGE_QUEUE:
+#   bo'sh              - bitta jarayon (xotiradagi menejer)
+#   sqlite:///fayl.db  - tashqi servislarsiz, umumiy SQLite fayli orqali
+#   redis://, amqp://  - python-socketio ning tayyor Redis/Kombu menejerlari
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE', '')
+
+class SQLiteBusManager(PubSubManager):
+    """Umumiy SQLite jadvali orqali ishlaydigan pub/sub menejeri.
+
+    Har bir publish jadvalga qator qo'shadi, har bir worker esa oxirgi
+    ko'rgan id dan keyingi qatorlarni poll_interval oralig'ida o'qiydi.
+    Eski qatorlar retention soniyadan keyin o'chiriladi.
+    """
+    name = 'sqlite'
+
+    def __init__(self, url, channel='socketio', write_only=False, logger=None,
+                 json=None, poll_interval=0.02, retention=60):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.path = url[len('sqlite:///'):]
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.conn = self._connect()
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS socketio_bus ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT, payload TEXT, created REAL)'
+        )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _publish(self, data):
+        self.conn.execute(
+            'INSERT INTO socketio_bus (channel, payload, created) VALUES (?, ?, ?)',
+            (self.channel, self.json.dumps(data), time.time())
+        )
+
+    def _listen(self):
+        conn = self._connect()
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM socketio_bus').fetchone()[0]
+        last_cleanup = time.time()
+        while True:
+            rows = conn.execute(
+                'SELECT id, payload FROM socketio_bus WHERE id > ? AND channel = ? ORDER BY id',
+                (last_id, self.channel)
+            ).fetchall()
+            for row_id, payload in rows:
+                last_id = row_id
+                yield payload
+            if time.time() - last_cleanup > self.retention:
+                last_cleanup = time.time()
+                conn.execute('DELETE FROM socketio_bus WHERE created < ?', (last_cleanup - self.retention,))
+            time.sleep(self.poll_interval)
+
+def socketio_queue_options(url):
+    if not url:
+        return {}
+    if url.startswith('sqlite:///'):
+        return {'client_manager': SQLiteBusManager(url)}
+    return {'message_queue': url}
 
 db = SQLAlchemy(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
+
+# --- LOGLAR ---
+logging.basicConfig(level=app.config['LOG_LEVEL'],
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+log = logging.getLogger('safechat')
+
+class SampledLogger:
+    """Har so'rovda chaqiriladigan joylar uchun: xabarning LOG_SAMPLE_RATE qismi yoziladi.
+    DEBUG yoqilgan bo'lsa hammasi yoziladi."""
+    def __init__(self, logger):
+        self.logger = logger
+
+    def log(self, level, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        if self.logger.isEnabledFor(logging.DEBUG) or random.random() < app.config['LOG_SAMPLE_RATE']:
+            self.logger.log(level, msg, *args)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(logging.WARNING, msg, *args)
+
+hot_log = SampledLogger(log)
+
+# --- METRIKALAR (/metrics, Prometheus matn formati) ---
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # labels -> [har bir bucket soni (kumulyativ emas), sum, count]
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, labels, [("le", _format_value(bound))])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labels, labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, labels)} {count}')
+        return lines
+
+class Metrics:
+    def __init__(self):
+        self.http_latency = Histogram('safechat_http_request_duration_seconds',
+                                      'HTTP so\'rovlarini bajarish vaqti', ('method', 'route', 'status'))
+        self.http_errors = Counter('safechat_http_errors_total',
+                                   '5xx bilan tugagan yoki istisno bergan HTTP so\'rovlar', ('method', 'route'))
+        self.socket_latency = Histogram('safechat_socket_event_duration_seconds',
+                                        'Socket.IO hodisa handlerlarini bajarish vaqti', ('event',))
+        self.socket_errors = Counter('safechat_socket_event_errors_total',
+                                     'Istisno bergan Socket.IO handlerlar', ('event',))
+        self.sql_queries = Counter('safechat_sql_queries_total',
+                                   'Bajarilgan SQL so\'rovlar', ('scope', 'name'))
+        self.sql_seconds = Counter('safechat_sql_query_seconds_total',
+                                   'SQL so\'rovlarga ketgan vaqt', ('scope', 'name'))
+        self.sql_per_unit = Histogram('safechat_sql_queries_per_unit',
+                                      'Bitta HTTP so\'rov yoki socket hodisadagi SQL so\'rovlar soni',
+                                      ('scope', 'name'), buckets=QUERY_COUNT_BUCKETS)
+        self.hub_lag = Histogram('safechat_eventlet_hub_lag_seconds',
+                                 'Eventlet hub kechikishi (uyg\'onish rejadan qancha kech)')
+        self.last_hub_lag = 0.0
+        self.started = time.time()
+
+    def begin(self, scope, name):
+        g.metrics_scope = (scope, name)
+        g.metrics_queries = 0
+        g.metrics_start = time.perf_counter()
+
+    def end(self):
+        """Joriy so'rov/hodisa uchun (scope, name, davomiylik) yoki None"""
+        scope = g.pop('metrics_scope', None)
+        if scope is None:
+            return None
+        self.sql_per_unit.observe(g.pop('metrics_queries', 0), *scope)
+        return scope[0], scope[1], time.perf_counter() - g.pop('metrics_start')
+
+    def record_query(self, elapsed):
+        scope = ('background', '')
+        if has_request_context() and 'metrics_scope' in g:
+            scope = g.metrics_scope
+            g.metrics_queries += 1
+        self.sql_queries.inc(*scope)
+        self.sql_seconds.inc(*scope, amount=elapsed)
+
+    def gauges(self):
+        """Ko'rsatish paytida hisoblanadigan qiymatlar"""
+        rooms = socketio.server.manager.rooms.get('/', {}) if socketio.server else {}
+        sockets = len(rooms.get(None, ()))
+        named_rooms = sum(1 for room in rooms if room is not None and room not in rooms.get(None, ()))
+        hasher = password_hasher.stats()
+        return [
+            ('safechat_socket_connections', 'Ulangan socketlar (shu worker)', sockets),
+            ('safechat_socket_rooms', 'Sid xonalaridan tashqari ochiq xonalar', named_rooms),
+            ('safechat_online_users', 'Onlayn foydalanuvchilar (shu worker)', presence.online_count()),
+            ('safechat_message_outbox_depth', 'Bazaga yozilishini kutayotgan xabarlar', _outbox.qsize()),
+            ('safechat_password_hash_waiting', 'Parol xeshlash navbatidagi so\'rovlar', hasher['waiting']),
+            ('safechat_eventlet_hub_lag_last_seconds', 'Oxirgi o\'lchangan hub kechikishi', self.last_hub_lag),
+            ('safechat_uptime_seconds', 'Jarayon ishlagan vaqt', time.time() - self.started),
+        ]
+
+    def render(self):
+        lines = []
+        for name, help, value in self.gauges():
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge', f'{name} {_format_value(value)}']
+        for metric in (self.http_latency, self.http_errors, self.socket_latency, self.socket_errors,
+                       self.sql_queries, self.sql_seconds, self.sql_per_unit, self.hub_lag):
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+@app.before_request
+def _metrics_before_request():
+    metrics.begin('http', request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.after_request
+def _metrics_after_request(response):
+    measured = metrics.end()
+    if measured:
+        _, route, elapsed = measured
+        metrics.http_latency.observe(elapsed, request.method, route, str(response.status_code))
+        if response.status_code >= 500:
+            metrics.http_errors.inc(request.method, route)
+    return response
+
+@app.teardown_request
+def _metrics_teardown_request(exc):
+    # after_request ishlamay qolgan holatlar (masalan, javob yuborishdagi istisno)
+    measured = metrics.end()
+    if measured:
+        _, route, elapsed = measured
+        metrics.http_latency.observe(elapsed, request.method, route, '500')
+        metrics.http_errors.inc(request.method, route)
+
+with app.app_context():
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def _metrics_before_cursor(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    @event.listens_for(db.engine, 'after_cursor_execute')
+    def _metrics_after_cursor(conn, cursor, statement, parameters, context, executemany):
+        metrics.record_query(time.perf_counter() - conn.info['metrics_start'].pop())
+
+    @event.listens_for(db.engine, 'handle_error')
+    def _metrics_cursor_error(context):
+        if context.connection is not None and context.connection.info.get('metrics_start'):
+            context.connection.info['metrics_start'].pop()
+
+class InstrumentedSocketIO(SocketIO):
+    """Har bir @socketio.on handler uchun vaqt, xato va SQL hisobini yozadi"""
+    def on(self, message, namespace=None):
+        register = super().on(message, namespace)
+
+        def decorator(handler):
+            @functools.wraps(handler)
+            def instrumented(*args):
+                metrics.begin('socket', message)
+                try:
+                    return handler(*args)
+                except Exception:
+                    metrics.socket_errors.inc(message)
+                    raise
+                finally:
+                    _, _, elapsed = metrics.end()
+                    metrics.socket_latency.observe(elapsed, message)
+            register(instrumented)
+            return handler
+        return decorator
+
+def _hub_lag_loop():
+    interval = app.config['HUB_LAG_INTERVAL']
+    while True:
+        started = time.monotonic()
+        time.sleep(interval)
+        lag = max(0.0, time.monotonic() - started - interval)
+        metrics.last_hub_lag = lag
+        metrics.hub_lag.observe(lag)
+
+socketio = InstrumentedSocketIO(app, cors_allowed_origins="*", async_mode='eventlet',
+                                **socketio_queue_options(app.config['SOCKETIO_MESSAGE_QUEUE']))
 CORS(app, resources={r"/*": {"origins": "*"}})
 
 # --- MA'LUMOTLAR BAZASI MODELLARI ---
@@ -42,12 +474,18 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     password = db.Column(db.String(200), nullable=False)
     phone = db.Column(db.String(20), unique=True, nullable=True)
-    avatar = db.Column(db.Text, nullable=True)
+    avatar = db.Column(db.Text, nullable=True)  # o'rta (medium) variant URL i
+    avatar_thumb = db.Column(db.String(200), nullable=True)  # ro'yxatlar uchun kichik variant
     is_blocked = db.Column(db.Boolean, default=False)
     is_online = db.Column(db.Boolean, default=False)
     blocked_users = db.Column(db.Text, default="")
     bio = db.Column(db.String(200), default="Hello! I am using SafeChat.")
     devices = db.Column(db.Text, default="[]")
+    last_seen = db.Column(db.DateTime, nullable=True)
+    # Profil hisoblagichlari (follow/unfollow va post yaratishda yangilanadi)
+    followers_count = db.Column(db.Integer, default=0)
+    following_count = db.Column(db.Integer, default=0)
+    posts_count = db.Column(db.Integer, default=0)
 
 class Follow(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -57,6 +495,8 @@ class Follow(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('follower_id', 'following_id', name='unique_follow'),
+        # Obunachilar soni: unique_follow (follower_id, ...) bilan boshlanadi, bu yetmaydi
+        db.Index('ix_follow_following', 'following_id', 'follower_id'),
     )
 
 class Message(db.Model):
@@ -69,6 +509,12 @@ class Message(db.Model):
     reply_info = db.Column(db.Text, nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Keyset paginatsiya: guruh tarixi va shaxsiy suhbat tarixi uchun
+        db.Index('ix_message_receiver_id', 'receiver', 'id'),
+        db.Index('ix_message_pair_id', 'sender', 'receiver', 'id'),
+    )
+
 class Entity(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
@@ -84,16 +530,109 @@ class EntityMember(db.Model):
     username = db.Column(db.String(100))
     role = db.Column(db.String(20), default='member') # 'admin' yoki 'member'
 
+    __table_args__ = (
+        # Guruh a'zolari / a'zolikni tekshirish (entity_id, username, role)
+        db.Index('ix_entity_member_entity_user', 'entity_id', 'username'),
+        # Foydalanuvchining guruhlari (handle_join)
+        db.Index('ix_entity_member_user', 'username', 'entity_id'),
+    )
+
+class Conversation(db.Model):
+    # Har bir (foydalanuvchi, suhbatdosh yoki guruh) juftligi uchun bitta qator:
+    # chatlar ro'yxati butun xabarlar tarixini skanerlamasdan shu jadvaldan o'qiladi
+    id = db.Column(db.Integer, primary_key=True)
+    owner = db.Column(db.String(100), nullable=False)
+    peer = db.Column(db.String(100), nullable=False)
+    is_entity = db.Column(db.Boolean, default=False)
+    last_message_id = db.Column(db.Integer, index=True)
+    last_message = db.Column(db.Text, default="")
+    last_time = db.Column(db.DateTime, default=datetime.utcnow)
+    unread_count = db.Column(db.Integer, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('owner', 'peer', name='unique_conversation'),
+        db.Index('ix_conversation_owner_time', 'owner', 'last_time'),
+        # Guruh xabarida barcha a'zolar qatorlarini yangilash (touch_conversations)
+        db.Index('ix_conversation_peer_entity', 'peer', 'is_entity'),
+    )
+
+class SessionToken(db.Model):
+    # Bazada tokenning o'zi emas, sha256 xeshi saqlanadi
+    token_hash = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class Block(db.Model):
+    # blocker foydalanuvchi blocked foydalanuvchini bloklagan
+    id = db.Column(db.Integer, primary_key=True)
+    blocker = db.Column(db.String(100), nullable=False)
+    blocked = db.Column(db.String(100), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('blocker', 'blocked', name='unique_block'),
+    )
+
+class StoredFile(db.Model):
+    # Kontent-manzilli fayl: bir xil baytlar diskda bir marta saqlanadi
+    sha256 = db.Column(db.String(64), primary_key=True)
+    path = db.Column(db.String(300), nullable=False)  # UPLOAD_FOLDER ga nisbatan
+    size = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class UploadSession(db.Model):
+    # Davom ettiriladigan yuklash; qabul qilingan baytlar soni .part fayl hajmidan olinadi
+    id = db.Column(db.String(32), primary_key=True)
+    username = db.Column(db.String(100), nullable=False)
+    filename = db.Column(db.String(200), nullable=False)
+    kind = db.Column(db.String(20), default='media')  # 'avatar', 'reel' yoki 'media'
+    size = db.Column(db.BigInteger, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DeletionJob(db.Model):
+    # Fonda o'chirish vazifasi. Tugamaguncha tombstone vazifasini ham bajaradi:
+    # max_message_id gacha bo'lgan tegishli xabarlar o'qishda yashiriladi
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'chat' yoki 'user'
+    target = db.Column(db.String(100), nullable=False)  # username
+    peer = db.Column(db.String(100), nullable=True)  # 'chat' uchun suhbatdosh
+    target_id = db.Column(db.Integer, nullable=True)  # 'user' uchun o'chirilgan user.id
+    files = db.Column(db.Text, nullable=True)  # 'user' uchun avatar URL lari (JSON)
+    requested_by = db.Column(db.String(100), nullable=True)
+    max_message_id = db.Column(db.Integer, default=0)
+    status = db.Column(db.String(20), default='pending')  # pending, running, done, failed
+    step = db.Column(db.String(30), nullable=True)
+    total = db.Column(db.Integer, nullable=True)
+    deleted = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_deletion_job_status', 'status', 'kind', 'target'),
+        # Har bir /api/messages dagi deletion_cutoff
+        db.Index('ix_deletion_job_target', 'target', 'status'),
+    )
+
+class SchemaVersion(db.Model):
+    # Bazaga qo'llangan oxirgi migratsiya raqami (pastdagi MIGRATIONS ro'yxati)
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
 # --- API YO'NALISHLARI ---
 @app.route('/api/create_entity', methods=['POST'])
 def create_entity():
     data = request.json
     name = data.get('name')
     etype = data.get('type')
-    username = data.get('username')
+    username = acting_username(data.get('username'))
 
     if not name:
         return jsonify({"status": "error", "message": "Nom kiritilmagan"}), 400
+    if not username:
+        return jsonify({"status": "error", "message": "Foydalanuvchi ko'rsatilmadi"}), 400
 
     new_ent = Entity(
         name=name, 
@@ -102,55 +641,99 @@ def create_entity():
         theme_color='from-purple-600 to-blue-500' if etype == 'group' else 'from-orange-500 to-red-500'
     )
     db.session.add(new_ent)
+    db.session.flush()
+    index_entity(new_ent)
     db.session.commit()
+    entity_directory.invalidate()
+    room_cache.invalidate(username)
+    if etype == 'group':
+        admin_stats.add('groups', 1)
     return jsonify({"status": "success", "name": name})
 
 @app.route('/api/chats/<username>')
 def get_user_chats(username):
-    # Foydalanuvchi qatnashgan barcha xabarlarni vaqt bo'yicha teskari tartibda olish
-    msgs = Message.query.filter((Message.sender == username) | (Message.receiver == username)).order_by(Message.timestamp.desc()).all()
-    
-    chats = {}
-    for m in msgs:
-        other = m.receiver if m.sender == username else m.sender
-        if other not in chats:
-            u = User.query.filter_by(username=other).first()
-            chats[other] = {
-                "other_user": other,
-                "avatar": u.avatar if u else None,
-                "last_message": m.content,
-                "last_time": m.timestamp.strftime("%H:%M")
-            }
-    return jsonify(list(chats.values()))
+    # Suhbatlar jadvalidan bitta indekslangan so'rov (kichik avatar bilan birga)
+    rows = db.session.query(Conversation, db.func.coalesce(User.avatar_thumb, User.avatar)).outerjoin(
+        User, User.username == Conversation.peer
+    ).filter(Conversation.owner == username).order_by(Conversation.last_time.desc()).all()
+
+    return jsonify([{
+        "other_user": c.peer,
+        "avatar": avatar,
+        "last_message": c.last_message,
+        "last_time": c.last_time.strftime("%H:%M"),
+        "unread_count": c.unread_count or 0
+    } for c, avatar in rows])
 
 @app.route('/api/delete-chat', methods=['POST'])
 def delete_chat():
     data = request.json
-    me, other = data.get('me'), data.get('other')
-    # Ikkala tomon orasidagi barcha xabarlarni o'chirish
-    Message.query.filter(((Message.sender == me) & (Message.receiver == other)) | 
-                         ((Message.sender == other) & (Message.receiver == me))).delete()
-    db.session.commit()
-    return jsonify({"status": "success"})
+    me, other = acting_username(data.get('me')), data.get('other')
+    if not me or not other:
+        return jsonify({"message": "Foydalanuvchilar ko'rsatilmadi"}), 400
+    # Chat darhol yashiriladi, xabarlar fonda to'plamlab o'chiriladi
+    job = schedule_chat_deletion(me, other)
+    return jsonify({"status": "success", "job_id": job.id})
 
 # --- OMMAVIY (GURUHLAR) UCHUN ---
+def conditional_response(body, etag, mimetype='application/json', last_modified=None):
+    """ETag (yoki If-Modified-Since) mos kelsa, tanasiz 304 qaytarish"""
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        not_modified = last_modified is not None and request.if_modified_since is not None \
+            and request.if_modified_since >= last_modified
+    resp = Response(status=304) if not_modified else Response(body, mimetype=mimetype)
+    resp.set_etag(etag)
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    return resp
+
+class EntityDirectoryCache:
+    """Guruh/kanallar ro'yxati: tayyor JSON va uning ETag i.
+
+    Har bir o'zgarish version ni oshiradi; keyingi so'rov ro'yxatni qayta
+    quradi. Boshqa workerlardagi o'zgarishlar ENTITY_CACHE_TTL ichida ko'rinadi.
+    """
+    def __init__(self):
+        self.version = 0
+        self.entry = None  # (version, qurilgan vaqt, body, etag)
+
+    def invalidate(self):
+        self.version += 1
+
+    def get(self):
+        entry = self.entry
+        if entry and entry[0] == self.version and \
+                time.monotonic() - entry[1] < app.config['ENTITY_CACHE_TTL']:
+            return entry
+        version = self.version
+        body = app.json.dumps(build_entity_directory())
+        entry = (version, time.monotonic(), body, hashlib.sha1(body.encode()).hexdigest())
+        self.entry = entry
+        return entry
+
+def build_entity_directory():
+    # A'zolar soni bitta GROUP BY so'rovi bilan
+    rows = db.session.query(Entity, db.func.count(EntityMember.id)) \
+        .outerjoin(EntityMember, EntityMember.entity_id == Entity.id) \
+        .group_by(Entity.id).all()
+    return [{
+        "id": e.id,
+        "name": e.name,
+        "type": e.type,
+        "image": e.image,
+        "theme": e.theme_color or "from-blue-500 to-indigo-600",
+        "member_count": m_count
+    } for e, m_count in rows]
+
+entity_directory = EntityDirectoryCache()
+
 @app.route('/api/entities')
 def get_all_entities():
     try:
-        ents = Entity.query.all()
-        result = []
-        for e in ents:
-            # Har bir guruh uchun a'zolar sonini sanash
-            m_count = EntityMember.query.filter_by(entity_id=e.id).count()
-            result.append({
-                "id": e.id,
-                "name": e.name,
-                "type": e.type,
-                "image": e.image,
-                "theme": e.theme_color or "from-blue-500 to-indigo-600",
-                "member_count": m_count
-            })
-        return jsonify(result)
+        _, _, body, etag = entity_directory.get()
+        return conditional_response(body, etag)
     except Exception as e:
         return jsonify([])
 
@@ -161,51 +744,691 @@ class Application(db.Model):
     reason = db.Column(db.Text)
     status = db.Column(db.String(20), default='new')  # new, accepted, rejected
 
-# Bazani yaratish (barcha modellar qo'shilgandan keyin)
-with app.app_context():
-    db.create_all()
+# --- SUHBATLAR RO'YXATI (CONVERSATION) ---
+def private_pair_filter(u1, u2):
+    """Ikki foydalanuvchi orasidagi xabarlar uchun filtr"""
+    return ((Message.sender == u1) & (Message.receiver == u2)) | \
+           ((Message.sender == u2) & (Message.receiver == u1))
+
+def _upsert_conversation(owner, peer, msg, is_entity, unread_inc=0):
+    conv = Conversation.query.filter_by(owner=owner, peer=peer).first()
+    if not conv:
+        conv = Conversation(owner=owner, peer=peer, is_entity=is_entity, unread_count=0)
+        db.session.add(conv)
+    conv.last_message_id = msg.id
+    conv.last_message = msg.content
+    conv.last_time = msg.timestamp
+    conv.unread_count = (conv.unread_count or 0) + unread_inc
+
+def touch_conversations(msg, is_entity=False):
+    """Yangi xabar bo'yicha suhbat qatorlarini yangilash (commit chaqiruvchida)"""
+    _upsert_conversation(msg.sender, msg.receiver, msg, is_entity)
+    if is_entity:
+        # Guruhning boshqa qatnashchilari qatorlari bitta UPDATE bilan yangilanadi
+        Conversation.query.filter(
+            Conversation.peer == msg.receiver,
+            Conversation.is_entity == True,
+            Conversation.owner != msg.sender
+        ).update({
+            'last_message_id': msg.id,
+            'last_message': msg.content,
+            'last_time': msg.timestamp,
+            'unread_count': Conversation.unread_count + 1
+        }, synchronize_session=False)
+    elif msg.receiver != msg.sender:
+        _upsert_conversation(msg.receiver, msg.sender, msg, False, unread_inc=1)
+
+def open_group_conversation(username, entity_name):
+    """A'zo qo'shilganda guruh qatori yaratiladi: keyingi xabarlar uning o'qilmaganlarini oshiradi"""
+    if Conversation.query.filter_by(owner=username, peer=entity_name).first():
+        return
+    last = Message.query.filter(Message.receiver == entity_name).order_by(Message.id.desc()).first()
+    db.session.add(Conversation(
+        owner=username, peer=entity_name, is_entity=True, unread_count=0,
+        last_message_id=last.id if last else None,
+        last_message=last.content if last else "",
+        last_time=last.timestamp if last else datetime.utcnow()
+    ))
+
+def close_group_conversation(username, entity_name):
+    Conversation.query.filter_by(owner=username, peer=entity_name).delete(synchronize_session=False)
+
+def retire_conversation_message(msg):
+    """O'chirilayotgan xabar oxirgisi bo'lsa, qatorlarni oldingi xabarga qaytarish"""
+    rows = Conversation.query.filter_by(last_message_id=msg.id)
+    first = rows.first()
+    if not first:
+        return
+    if first.is_entity:
+        q = Message.query.filter(Message.receiver == msg.receiver)
+    else:
+        q = Message.query.filter(private_pair_filter(msg.sender, msg.receiver))
+    prev = q.filter(Message.id != msg.id).order_by(Message.id.desc()).first()
+    if prev:
+        rows.update({
+            'last_message_id': prev.id,
+            'last_message': prev.content,
+            'last_time': prev.timestamp
+        }, synchronize_session=False)
+    else:
+        rows.delete(synchronize_session=False)
+
+def drop_private_conversation(u1, u2):
+    Conversation.query.filter(
+        ((Conversation.owner == u1) & (Conversation.peer == u2)) |
+        ((Conversation.owner == u2) & (Conversation.peer == u1))
+    ).delete(synchronize_session=False)
+
+def rebuild_conversations():
+    """Conversation jadvalini mavjud xabarlar tarixidan qayta qurish (bir martalik)"""
+    entity_names = {name for (name,) in db.session.query(Entity.name)}
+    # Shaxsiy chatlar: juftlikdagi eng so'nggi xabar (ikki yo'nalish bo'yicha)
+    private = Message.receiver.notin_(db.select(Entity.name))
+    pairs = db.union_all(
+        db.select(Message.sender.label('owner'), Message.receiver.label('peer'), Message.id.label('mid'))
+        .where(private),
+        db.select(Message.receiver.label('owner'), Message.sender.label('peer'), Message.id.label('mid'))
+        .where(private)
+    ).subquery()
+    latest = db.session.execute(
+        db.select(pairs.c.owner, pairs.c.peer, db.func.max(pairs.c.mid))
+        .group_by(pairs.c.owner, pairs.c.peer)
+    ).all()
+    latest = [row for row in latest if row[0] not in entity_names]
+    # Guruhlar: guruhning (a'zoning o'zinikimas) eng so'nggi xabari har bir a'zoga
+    group_latest = db.select(Message.receiver.label('name'), db.func.max(Message.id).label('mid')) \
+        .where(Message.receiver.in_(db.select(Entity.name))).group_by(Message.receiver).subquery()
+    latest += db.session.execute(
+        db.select(EntityMember.username, Entity.name, group_latest.c.mid)
+        .join(Entity, Entity.id == EntityMember.entity_id)
+        .join(group_latest, group_latest.c.name == Entity.name)
+        .where(EntityMember.username.isnot(None))
+        .distinct()
+    ).all()
+
+    Conversation.query.delete()
+    for i in range(0, len(latest), 500):
+        chunk = latest[i:i + 500]
+        msgs = {m.id: m for m in Message.query.filter(Message.id.in_([r[2] for r in chunk]))}
+        for owner, peer, mid in chunk:
+            m = msgs[mid]
+            db.session.add(Conversation(
+                owner=owner, peer=peer, is_entity=peer in entity_names,
+                last_message_id=m.id, last_message=m.content,
+                last_time=m.timestamp, unread_count=0
+            ))
+    db.session.commit()
+
+def backfill_group_conversations():
+    """Guruhda hali yozmagan a'zolar uchun yetishmayotgan qatorlarni yaratish (bir martalik)"""
+    missing = db.session.query(EntityMember.username, Entity.name).join(
+        Entity, Entity.id == EntityMember.entity_id
+    ).outerjoin(
+        Conversation, (Conversation.owner == EntityMember.username) & (Conversation.peer == Entity.name)
+    ).filter(Conversation.id.is_(None), EntityMember.username.isnot(None)).distinct().all()
+    for username, name in missing:
+        open_group_conversation(username, name)
+    db.session.commit()
+
+# --- XABARLAR TARIXI (KEYSET PAGINATSIYA) ---
+def fetch_message_page(branches, before_id=None, after_id=None, limit=50):
+    """Suhbatning bitta sahifasi (id bo'yicha o'suvchi tartibda).
+
+    Har bir tarmoq (masalan sender->receiver va receiver->sender) alohida
+    (sender, receiver, id) / (receiver, id) indeksi bo'yicha LIMIT bilan
+    o'qiladi, natijalar Pythonda birlashtiriladi. Hech qaysi kursor
+    berilmasa eng yangi sahifa qaytadi.
+    """
+    newest_first = after_id is None
+    msgs = []
+    for cond in branches:
+        q = Message.query.filter(cond)
+        if before_id is not None:
+            q = q.filter(Message.id < before_id)
+        if after_id is not None:
+            q = q.filter(Message.id > after_id)
+        q = q.order_by(Message.id.desc() if newest_first else Message.id.asc())
+        msgs.extend(q.limit(limit).all())
+    msgs.sort(key=lambda m: m.id, reverse=newest_first)
+    msgs = msgs[:limit]
+    msgs.sort(key=lambda m: m.id)
+    return msgs
+
+# --- FOYDALANUVCHI BO'YICHA KESHLAR ---
+class UserCache:
+    """key -> loader(key) natijasi; LRU (max_size) va TTL bilan cheklangan.
+
+    O'zgarishlar shu jarayonda invalidate qilinadi; boshqa workerlardagi
+    nusxalar ko'pi bilan TTL soniya eskirgan bo'lishi mumkin.
+    """
+    def __init__(self, loader, size_key, ttl_key):
+        self.loader = loader
+        self.size_key = size_key
+        self.ttl_key = ttl_key
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry and now - entry[0] < app.config[self.ttl_key]:
+            self.entries.move_to_end(key)
+            return entry[1]
+        value = self.loader(key)
+        self.entries[key] = (now, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > app.config[self.size_key]:
+            self.entries.popitem(last=False)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+def load_blocked(blocker):
+    return frozenset(b for (b,) in db.session.query(Block.blocked).filter(Block.blocker == blocker))
+
+def load_group_rooms(username):
+    # Foydalanuvchi a'zo bo'lgan guruhlar nomi bitta JOIN so'rovi bilan
+    return tuple(name for (name,) in db.session.query(Entity.name)
+                 .join(EntityMember, EntityMember.entity_id == Entity.id)
+                 .filter(EntityMember.username == username, Entity.type == 'group'))
+
+# blocker -> bloklaganlari to'plami (handle_send dagi tekshiruv uchun)
+block_cache = UserCache(load_blocked, 'BLOCK_CACHE_SIZE', 'BLOCK_CACHE_TTL')
+# username -> a'zo bo'lgan guruh xonalari (handle_join uchun)
+room_cache = UserCache(load_group_rooms, 'ROOM_CACHE_SIZE', 'ROOM_CACHE_TTL')
+
+# --- SESSIYALAR ---
+# login_api token beradi. REST so'rovlari uni 'Authorization: Bearer <token>'
+# sarlavhasida, socket esa ulanishdagi auth {token} (yoki 'join') da yuboradi va
+# token shu sid ga bog'lanadi. Token egasi session_cache dan olinadi, shuning
+# uchun handlerlar chaqiruvchini bazaga murojaatsiz biladi. Tokensiz eski
+# mijozlar SESSION_REQUIRED yoqilmaguncha tanadagi username bilan ishlaydi.
+SessionUser = namedtuple('SessionUser', 'id username')
+socket_sessions = {}  # sid -> token_hash
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def load_session(token_hash):
+    row = db.session.query(User.id, User.username).join(
+        SessionToken, SessionToken.user_id == User.id
+    ).filter(
+        SessionToken.token_hash == token_hash,
+        SessionToken.expires_at > datetime.utcnow(),
+        User.is_blocked.isnot(True)
+    ).first()
+    return SessionUser(*row) if row else None
+
+# token_hash -> SessionUser (yoki None: token yaroqsiz)
+session_cache = UserCache(load_session, 'SESSION_CACHE_SIZE', 'SESSION_CACHE_TTL')
+
+def issue_session(user):
+    token = secrets.token_urlsafe(32)
+    token_hash = hash_token(token)
+    db.session.add(SessionToken(token_hash=token_hash, user_id=user.id,
+                                expires_at=datetime.utcnow() + timedelta(seconds=app.config['SESSION_TTL'])))
+    session_cache.put(token_hash, SessionUser(user.id, user.username))
+    return token
+
+def _drop_cached_sessions(token_hashes):
+    for token_hash in token_hashes:
+        session_cache.invalidate(token_hash)
+    # Shu jarayondagi bekor qilingan socketlar uziladi
+    for sid, token_hash in list(socket_sessions.items()):
+        if token_hash in token_hashes:
+            socketio.server.disconnect(sid, namespace='/')
+
+def revoke_sessions(user_id):
+    """Foydalanuvchining barcha tokenlarini bekor qilish"""
+    token_hashes = {h for (h,) in db.session.query(SessionToken.token_hash)
+                    .filter(SessionToken.user_id == user_id)}
+    if token_hashes:
+        SessionToken.query.filter(SessionToken.token_hash.in_(token_hashes)).delete(synchronize_session=False)
+    _drop_cached_sessions(token_hashes)
+
+def revoke_session(token_hash):
+    SessionToken.query.filter_by(token_hash=token_hash).delete(synchronize_session=False)
+    _drop_cached_sessions({token_hash})
+
+def refresh_user_sessions(user_id):
+    """Username o'zgarganda keshdagi eski nomni tashlab yuborish"""
+    for (token_hash,) in db.session.query(SessionToken.token_hash).filter(SessionToken.user_id == user_id):
+        session_cache.invalidate(token_hash)
+
+def request_token_hash():
+    # Socket handlerlarida request.sid bor: token ulanishga bog'langan
+    sid = getattr(request, 'sid', None)
+    if sid is not None:
+        return socket_sessions.get(sid)
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        return hash_token(auth[len('Bearer '):].strip())
+    return None
+
+def current_session():
+    token_hash = request_token_hash()
+    return session_cache.get(token_hash) if token_hash else None
+
+def acting_username(claimed):
+    """Amalni bajaruvchi: token bo'lsa uning egasi, aks holda so'rovdagi nom"""
+    identity = current_session()
+    if identity:
+        return identity.username
+    return None if app.config['SESSION_REQUIRED'] else claimed
+
+def bind_socket_session(sid, token):
+    token_hash = hash_token(token)
+    if session_cache.get(token_hash) is None:
+        return False
+    socket_sessions[sid] = token_hash
+    return True
+
+def migrate_blocked_users_column():
+    """Eski User.blocked_users satrini Block jadvaliga ko'chirish (bir martalik).
+
+    Eski formatda X.blocked_users = X ni bloklaganlar ro'yxati edi.
+    """
+    existing = set(db.session.query(Block.blocker, Block.blocked))
+    for username, blocked_users in db.session.query(User.username, User.blocked_users) \
+            .filter(User.blocked_users != None, User.blocked_users != ''):
+        for blocker in {b.strip() for b in blocked_users.split(',') if b.strip()}:
+            if (blocker, username) not in existing:
+                existing.add((blocker, username))
+                db.session.add(Block(blocker=blocker, blocked=username))
+    db.session.commit()
+
+# --- QIDIRUV INDEKSI (SQLite FTS5) ---
+# Foydalanuvchilar (username, bio), guruhlar (name) va xabarlar (content)
+# FTS5 jadvallarida rowid = asl jadval id si bilan saqlanadi va yozish
+# yo'llaridan (ro'yxatdan o'tish, profil, entity yaratish, xabar
+# yuborish/tahrirlash/o'chirish) shu tranzaksiyada yangilanadi. SQLite
+# bo'lmagan bazalarda (yoki FTS5 yo'q bo'lsa) LIKE bo'yicha qidiriladi.
+# search_message tashqi kontentli jadval (content='message'): unda faqat
+# indeks bor, xabar matni ikkinchi marta saqlanmaydi. Shuning uchun indeksdan
+# olib tashlash 'delete' buyrug'i va eski matn bilan bajariladi.
+FTS_TOKENIZER = "tokenize='unicode61 remove_diacritics 2'"
+search_user_t = db.table('search_user', db.column('rowid'), db.column('username'), db.column('bio'))
+search_entity_t = db.table('search_entity', db.column('rowid'), db.column('name'))
+# search_message ustuni: FTS5 buyruqlari ('delete', 'rebuild') uchun yashirin ustun
+search_message_t = db.table('search_message', db.column('rowid'), db.column('content'), db.column('search_message'))
+_fts_available = None
+
+def fts_enabled():
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = False
+        if db.engine.dialect.name == 'sqlite':
+            with db.engine.connect() as conn:
+                _fts_available = bool(conn.execute(
+                    db.text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar())
+    return _fts_available
+
+def fts_search_enabled():
+    # SEARCH_FTS=0 faqat qidiruvni LIKE ga o'tkazadi (solishtirish uchun), indeks yangilanishda davom etadi
+    return app.config['SEARCH_FTS'] and fts_enabled()
+
+def fts_query(q):
+    """Foydalanuvchi matnini xavfsiz MATCH ifodasiga aylantirish (prefiks qidiruv)"""
+    return ' '.join(f'"{token}"*' for token in re.findall(r'\w+', q))
+
+def create_search_index():
+    """FTS5 jadvallarini yaratish va mavjud ma'lumotlardan to'ldirish"""
+    if not fts_enabled():
+        return
+    with db.engine.begin() as conn:
+        conn.execute(db.text(f"CREATE VIRTUAL TABLE IF NOT EXISTS search_user USING fts5(username, bio, {FTS_TOKENIZER})"))
+        conn.execute(db.text(f"CREATE VIRTUAL TABLE IF NOT EXISTS search_entity USING fts5(name, {FTS_TOKENIZER})"))
+        conn.execute(db.delete(search_user_t))
+        conn.execute(db.delete(search_entity_t))
+        conn.execute(search_user_t.insert().from_select(
+            ['rowid', 'username', 'bio'], db.select(User.id, User.username, db.func.coalesce(User.bio, ''))))
+        conn.execute(search_entity_t.insert().from_select(['rowid', 'name'], db.select(Entity.id, Entity.name)))
+    create_message_search_index()
+
+def create_message_search_index():
+    """search_message ni tashqi kontentli jadval sifatida qayta yaratib, message dan qurish"""
+    if not fts_enabled():
+        return
+    with db.engine.begin() as conn:
+        conn.execute(db.text("DROP TABLE IF EXISTS search_message"))
+        conn.execute(db.text("CREATE VIRTUAL TABLE IF NOT EXISTS search_message USING fts5("
+                             f"content, content='message', content_rowid='id', {FTS_TOKENIZER})"))
+        conn.execute(db.text("INSERT INTO search_message(search_message) VALUES ('rebuild')"))
+
+def index_user(user):
+    if not fts_enabled():
+        return
+    db.session.execute(db.delete(search_user_t).where(search_user_t.c.rowid == user.id))
+    db.session.execute(search_user_t.insert().values(rowid=user.id, username=user.username, bio=user.bio or ''))
+
+def unindex_user(user_id):
+    if fts_enabled():
+        db.session.execute(db.delete(search_user_t).where(search_user_t.c.rowid == user_id))
+
+def index_entity(entity):
+    if fts_enabled():
+        db.session.execute(search_entity_t.insert().values(rowid=entity.id, name=entity.name))
+
+def index_messages(msgs):
+    if fts_enabled() and msgs:
+        db.session.execute(search_message_t.insert(), [{'rowid': m.id, 'content': m.content} for m in msgs])
+
+def reindex_message(msg, old_content):
+    """Tahrirlangan xabar: indeksdagi eski matn tokenlari olib tashlanib, yangisi qo'shiladi"""
+    if fts_enabled():
+        db.session.execute(db.text(
+            "INSERT INTO search_message(search_message, rowid, content) VALUES ('delete', :id, :content)"
+        ), {'id': msg.id, 'content': old_content})
+        index_messages([msg])
+
+def unindex_messages(condition):
+    """Filtr bo'yicha o'chirilayotgan xabarlarni indeksdan olib tashlash (DELETE dan oldin)"""
+    if fts_enabled():
+        db.session.execute(search_message_t.insert().from_select(
+            ['search_message', 'rowid', 'content'],
+            db.select(db.literal('delete'), Message.id, Message.content).where(condition)))
+
+def _ordered_by_ids(model, ids):
+    rows = {r.id: r for r in model.query.filter(model.id.in_(ids))} if ids else {}
+    return [rows[i] for i in ids if i in rows]
+
+def search_users_ranked(q, limit, offset=0):
+    if fts_search_enabled():
+        match = fts_query(q)
+        if not match:
+            return []
+        ids = [r[0] for r in db.session.execute(db.text(
+            "SELECT rowid FROM search_user WHERE search_user MATCH :q ORDER BY rank LIMIT :limit OFFSET :offset"
+        ), {'q': match, 'limit': limit, 'offset': offset})]
+        return _ordered_by_ids(User, ids)
+    pattern = f'%{q}%'
+    return User.query.filter(User.username.ilike(pattern) | User.bio.ilike(pattern)).order_by(
+        db.case((User.username.ilike(f'{q}%'), 0), else_=1), User.username
+    ).limit(limit).offset(offset).all()
+
+def search_entities_ranked(q, limit, offset=0):
+    if fts_search_enabled():
+        match = fts_query(q)
+        if not match:
+            return []
+        ids = [r[0] for r in db.session.execute(db.text(
+            "SELECT rowid FROM search_entity WHERE search_entity MATCH :q ORDER BY rank LIMIT :limit OFFSET :offset"
+        ), {'q': match, 'limit': limit, 'offset': offset})]
+        return _ordered_by_ids(Entity, ids)
+    return Entity.query.filter(Entity.name.ilike(f'%{q}%')).order_by(
+        db.case((Entity.name.ilike(f'{q}%'), 0), else_=1), Entity.name
+    ).limit(limit).offset(offset).all()
+
+def search_messages_ranked(username, q, limit, offset=0):
+    """Faqat foydalanuvchi ko'ra oladigan xabarlar: o'zi yozgan/olgan yoki a'zo guruhlari"""
+    my_groups = db.select(Entity.name).join(EntityMember, EntityMember.entity_id == Entity.id) \
+        .where(EntityMember.username == username)
+    visible = (Message.sender == username) | (Message.receiver == username) | Message.receiver.in_(my_groups)
+    if fts_search_enabled():
+        match = fts_query(q)
+        if not match:
+            return []
+        rank = db.literal_column('search_message.rank')
+        ids = [r[0] for r in db.session.execute(
+            db.select(Message.id)
+            .join(search_message_t, search_message_t.c.rowid == Message.id)
+            .where(db.literal_column('search_message').op('MATCH')(match), visible)
+            .order_by(rank).limit(limit).offset(offset)
+        )]
+        return _ordered_by_ids(Message, ids)
+    return Message.query.filter(Message.content.ilike(f'%{q}%'), visible) \
+        .order_by(Message.id.desc()).limit(limit).offset(offset).all()
 
 # --- YORDAMCHI FUNKSIYALAR ---
 def user_is_blocked_by(target_username, sender_username):
     """Target foydalanuvchi senderni bloklaganmi?"""
-    user = User.query.filter_by(username=target_username).first()
-    if user and user.blocked_users:
-        return sender_username in user.blocked_users.split(',')
-    return False
+    return sender_username in block_cache.get(target_username)
 
 def allowed_file(filename):
     """Faylning kengaytmasi ruxsat etilganmi?"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# --- MEDIA FAYLLARNI BERISH (RANGE, ETAG) ---
+# Video va yuklangan fayllar bitta yo'ldan beriladi: kuchli ETag,
+# bitta va bir nechta oraliqli (multipart/byteranges) 206 javoblar.
+# To'liq fayl va bitta oraliq wsgi.file_wrapper orqali (gunicorn da sendfile)
+# yuboriladi. Server uni bermasa, fayl MEDIA_CHUNK_SIZE lik bo'laklarda
+# o'qiladi va har bir bo'lakdan keyin eventlet hub boshqa greenletlarga o'tadi.
+MEDIA_CHUNK_SIZE = 256 * 1024
+MEDIA_MAX_RANGES = 16
+CAS_NAME_RE = re.compile(r'^[0-9a-f]{64}(\.\w+)?$')
+
+def _read_range(path, start, stop):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(MEDIA_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def _file_body(path, start, stop):
+    if 'wsgi.file_wrapper' in request.environ:
+        # PEP 3333: server Content-Length dan ortiq bayt yubormaydi
+        f = open(path, 'rb')
+        f.seek(start)
+        return wrap_file(request.environ, f, MEDIA_CHUNK_SIZE), True
+    return _read_range(path, start, stop), False
+
+def _normalize_ranges(ranges, length):
+    result = []
+    for start, stop in ranges:
+        if start < 0:
+            start, stop = max(length + start, 0), length
+        stop = length if stop is None else min(stop, length)
+        if start < stop:
+            result.append((start, stop))
+    return result
+
+def send_media(path, immutable=False):
+    """Faylni Range/ETag/keshlash sarlavhalari bilan berish"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return jsonify({"error": "Fayl topilmadi"}), 404
+    length = st.st_size
+    name = os.path.basename(path)
+    if immutable:
+        etag = name.split('.', 1)[0]
+    else:
+        etag = f"{length:x}-{st.st_mtime_ns:x}"
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    headers = {
+        'ETag': f'"{etag}"',
+        'Accept-Ranges': 'bytes',
+        'Last-Modified': http_date(st.st_mtime),
+        # Kontent-manzilli fayllar hech qachon o'zgarmaydi
+        'Cache-Control': 'public, max-age=31536000, immutable' if immutable else 'no-cache',
+        'X-Content-Type-Options': 'nosniff',
+    }
+    # Rasm/video/audio dan boshqasi (html, svg va h.k.) sahifa sifatida ochilmaydi
+    if not mimetype.startswith(('image/', 'video/', 'audio/')) or mimetype == 'image/svg+xml':
+        headers['Content-Disposition'] = 'attachment'
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+
+    ranges = None
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if range_header and (not if_range or if_range.strip('"') == etag):
+        parsed = parse_range_header(range_header)
+        if parsed and parsed.units == 'bytes' and len(parsed.ranges) <= MEDIA_MAX_RANGES:
+            ranges = _normalize_ranges(parsed.ranges, length)
+            if not ranges:
+                headers['Content-Range'] = f"bytes */{length}"
+                return Response(status=416, headers=headers)
+
+    if not ranges:
+        body, direct = _file_body(path, 0, length)
+        headers['Content-Length'] = str(length)
+        return Response(body, status=200, mimetype=mimetype, headers=headers, direct_passthrough=direct)
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        body, direct = _file_body(path, start, stop)
+        headers['Content-Range'] = f"bytes {start}-{stop - 1}/{length}"
+        headers['Content-Length'] = str(stop - start)
+        return Response(body, status=206, mimetype=mimetype, headers=headers, direct_passthrough=direct)
+
+    boundary = secrets.token_hex(12)
+    parts = [((f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+               f"Content-Range: bytes {start}-{stop - 1}/{length}\r\n\r\n").encode(), start, stop)
+             for start, stop in ranges]
+    closing = f"\r\n--{boundary}--\r\n".encode()
+
+    def multipart_body():
+        for part_header, start, stop in parts:
+            yield part_header
+            yield from _read_range(path, start, stop)
+        yield closing
+
+    headers['Content-Length'] = str(sum(len(h) + stop - start for h, start, stop in parts) + len(closing))
+    return Response(multipart_body(), status=206, headers=headers,
+                    mimetype=f"multipart/byteranges; boundary={boundary}")
+
+# --- STATIK ASSETLAR (XOTIRADA, OLDINDAN SIQILGAN) ---
+# index.html va PWA fayllari ishga tushganda bir marta o'qiladi, gzip va
+# (brotli o'rnatilgan bo'lsa) br bilan oldindan siqiladi. Har bir fayl
+# /assets/<nom>.<hash>.<kengaytma> manzilida ham beriladi (immutable kesh);
+# index.html va manifest.json ichidagi havolalar shu manzillarga almashtiriladi.
+# Asl manzillar (/, /manifest.json, /sw.js ...) no-cache + ETag bilan qoladi.
+# Ro'yxat tartibi muhim: havola qilinadigan fayl havola qiluvchidan oldin keladi.
+STATIC_ASSETS = ['logo.png', 'icon.png', 'manifest.json', 'sw.js', 'index.html']
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/manifest+json', 'application/javascript',
+                      'text/javascript', 'image/svg+xml')
+
+class StaticAsset:
+    def __init__(self, name, data, mimetype):
+        self.name = name
+        self.mimetype = mimetype
+        digest = hashlib.sha256(data).hexdigest()
+        self.etag = digest[:32]
+        base, ext = os.path.splitext(name)
+        self.url = f"/assets/{base}.{digest[:12]}{ext}"
+        self.bodies = {'identity': data}
+        if mimetype.startswith(COMPRESSIBLE_TYPES):
+            self.bodies['gzip'] = gzip.compress(data, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.bodies['br'] = brotli.compress(data, quality=11)
+            # Siqish foyda bermasa, asl baytlar beriladi
+            for encoding in ('br', 'gzip'):
+                if encoding in self.bodies and len(self.bodies[encoding]) >= len(data):
+                    del self.bodies[encoding]
+
+class StaticAssets:
+    def __init__(self, root, names):
+        self.root = root
+        self.names = names
+        self.assets = {}
+        self.by_url = {}
+
+    def load(self):
+        assets = {}
+        for name in self.names:
+            path = os.path.join(self.root, name)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            if name == 'manifest.json':
+                mimetype = 'application/manifest+json'
+            if mimetype.startswith(COMPRESSIBLE_TYPES) and name != 'sw.js':
+                data = self._rewrite_links(data, assets)
+            assets[name] = StaticAsset(name, data, mimetype)
+        self.assets = assets
+        self.by_url = {a.url: a for a in assets.values()}
+
+    @staticmethod
+    def _rewrite_links(data, assets):
+        text = data.decode('utf-8')
+        for dep in assets.values():
+            for quote in ('"', "'"):
+                text = text.replace(f'{quote}/{dep.name}{quote}', f'{quote}{dep.url}{quote}')
+                text = text.replace(f'{quote}{dep.name}{quote}', f'{quote}{dep.url}{quote}')
+        return text.encode('utf-8')
+
+static_assets = StaticAssets(app.root_path, STATIC_ASSETS)
+static_assets.load()
+
+def send_asset(name, immutable=False):
+    """Xotiradagi assetni Accept-Encoding bo'yicha mos siqilgan holda berish"""
+    asset = static_assets.assets.get(name)
+    if asset is None:
+        return jsonify({"error": "Fayl topilmadi"}), 404
+    encoding = 'identity'
+    for candidate in ('br', 'gzip'):
+        if candidate in asset.bodies and request.accept_encodings[candidate]:
+            encoding = candidate
+            break
+    resp = conditional_response(asset.bodies[encoding], f"{asset.etag}-{encoding}", asset.mimetype)
+    if encoding != 'identity':
+        resp.headers['Content-Encoding'] = encoding
+    if len(asset.bodies) > 1:
+        resp.vary.add('Accept-Encoding')
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable' if immutable else 'no-cache'
+    return resp
+
 # --- STATIC FAYLLARNI XIZMAT QILISH ---
 @app.route('/<path:path>')
 def serve_static(path):
+    # Videolar (masalan postlar/*.mp4) seek uchun Range bilan beriladi
+    if path.rsplit('.', 1)[-1].lower() in ALLOWED_EXTENSIONS:
+        full_path = safe_join(app.root_path, path)
+        if full_path:
+            return send_media(full_path)
+    if path in static_assets.assets:
+        return send_asset(path)
     return send_from_directory('', path)
 
 @app.route('/user/<username>')
 def show_user_profile(username):
-    return send_from_directory('', 'index.html')
+    return send_asset('index.html')
 
 @app.errorhandler(404)
 def not_found(e):
-    return send_from_directory('', 'index.html')
+    # SPA: noma'lum yo'llar ham xotiradagi index.html ni oladi
+    return send_asset('index.html')
 
 @app.route('/manifest.json')
 def serve_manifest():
-    return send_from_directory(os.getcwd(), 'manifest.json')
+    return send_asset('manifest.json')
 
 @app.route('/logo.png')
 def serve_logo():
-    return send_from_directory(os.getcwd(), 'logo.png')
+    return send_asset('logo.png')
 
 @app.route('/sw.js')
 def serve_sw():
-    return send_from_directory(os.getcwd(), 'sw.js')
+    return send_asset('sw.js')
+
+@app.route('/assets/<name>')
+def serve_fingerprinted(name):
+    asset = static_assets.by_url.get(f"/assets/{name}")
+    if not asset:
+        return jsonify({"error": "Fayl topilmadi"}), 404
+    return send_asset(asset.name, immutable=True)
 
 @app.route('/uploads/<path:folder>/<path:filename>')
 def serve_uploads(folder, filename):
-    directory = os.path.join(app.config['UPLOAD_FOLDER'], folder)
-    return send_from_directory(directory, filename)
+    # Yuklashlar UPLOAD_FOLDER ga (joriy papkaga nisbatan) yoziladi, shu yerdan o'qiladi
+    path = safe_join(os.path.abspath(app.config['UPLOAD_FOLDER']), folder, filename)
+    if not path:
+        return jsonify({"error": "Fayl topilmadi"}), 404
+    immutable = folder.split('/', 1)[0] == 'cas' and bool(CAS_NAME_RE.match(os.path.basename(path)))
+    return send_media(path, immutable=immutable)
 
 # --- ASOSIY SAHIFA ---
 @app.route('/')
@@ -214,7 +1437,8 @@ def index():
 
 @app.route('/api/user/profile/<username>', methods=['GET'])
 def get_user_profile(username):
-    viewer_username = request.args.get('viewer')
+    identity = current_session()
+    viewer_username = identity.username if identity else acting_username(request.args.get('viewer'))
     if not viewer_username:
         return jsonify({"error": "Viewer talab qilinadi"}), 400
 
@@ -222,35 +1446,88 @@ def get_user_profile(username):
     if not user:
         return jsonify({"error": "Foydalanuvchi topilmadi"}), 404
 
-    viewer = User.query.filter_by(username=viewer_username).first()
+    # Token bo'lsa, viewer keshdan olinadi
+    viewer = identity or User.query.filter_by(username=viewer_username).first()
     if not viewer:
         return jsonify({"error": "Viewer topilmadi"}), 404
 
     # Bloklanganmi?
-    blocked_users = user.blocked_users.split(',') if user.blocked_users else []
-    is_blocked_by_viewer = viewer_username in blocked_users
+    is_blocked_by_viewer = user_is_blocked_by(viewer_username, username)
+    is_following = Follow.query.filter_by(follower_id=viewer.id, following_id=user.id).first() is not None
 
     return jsonify({
         "username": user.username,
         "full_name": user.username,  # agar full_name bo'lmasa
         "bio": user.bio,
         "avatar": user.avatar or f"https://ui-avatars.com/api/?name={user.username}",
+        "avatar_thumb": user.avatar_thumb,
         "phone": user.phone if viewer_username == username else None,
-        "posts_count": posts_count,
-        "followers_count": followers_count,
-        "following_count": following_count,
+        "posts_count": user.posts_count or 0,
+        "followers_count": user.followers_count or 0,
+        "following_count": user.following_count or 0,
         "is_following": is_following,
         "is_blocked_by_viewer": is_blocked_by_viewer
     })
 
+# --- PROFIL HISOBLAGICHLARI ---
+def bump_follow_counters(follower_id, following_id, delta):
+    """Follow/unfollow bilan bitta tranzaksiyada atomik UPDATE"""
+    User.query.filter_by(id=following_id).update(
+        {'followers_count': db.func.coalesce(User.followers_count, 0) + delta}, synchronize_session=False)
+    User.query.filter_by(id=follower_id).update(
+        {'following_count': db.func.coalesce(User.following_count, 0) + delta}, synchronize_session=False)
+
+def emit_follow_update(viewer_username, target):
+    db.session.refresh(target)
+    payload = {
+        'target': target.username,
+        'followers_count': target.followers_count or 0
+    }
+    # Faqat ikki tomonning xonalariga (broadcast emas)
+    socketio.emit('follow_update', payload, room=target.username)
+    socketio.emit('follow_update', payload, room=viewer_username)
+
+def reconcile_counters():
+    """Hisoblagichlarni haqiqiy jadvallardan bitta UPDATE bilan qayta hisoblash"""
+    users = User.__table__
+    follows = Follow.__table__
+    posts = Post.__table__
+    db.session.execute(db.update(users).values(
+        followers_count=db.select(db.func.count()).where(follows.c.following_id == users.c.id).scalar_subquery(),
+        following_count=db.select(db.func.count()).where(follows.c.follower_id == users.c.id).scalar_subquery(),
+        posts_count=db.select(db.func.count()).where(posts.c.author == users.c.username).scalar_subquery()
+    ))
+    db.session.commit()
+
+def _counters_reconcile_loop():
+    while True:
+        time.sleep(app.config['COUNTERS_RECONCILE_INTERVAL'])
+        try:
+            with app.app_context():
+                reconcile_counters()
+        except Exception:
+            log.exception("RECONCILE_ERROR")
+
+@app.route('/api/admin/reconcile_counters', methods=['POST'])
+def reconcile_counters_api():
+    data = request.json or {}
+    if data.get('admin') != 'admin':
+        return jsonify({"message": "Ruxsat yo'q"}), 403
+    reconcile_counters()
+    return jsonify({"status": "success"})
+
 @app.route('/api/user/follow', methods=['POST'])
 def follow_user():
     data = request.json
-    viewer_username = data['viewer']
+    identity = current_session()
+    viewer_username = identity.username if identity else acting_username(data.get('viewer'))
+    if not viewer_username:
+        return jsonify({"error": "Viewer talab qilinadi"}), 400
     target_username = data['target']
     action = data['action']  # 'follow' yoki 'unfollow'
 
-    viewer = User.query.filter_by(username=viewer_username).first()
+    # Token bo'lsa, viewer keshdan olinadi
+    viewer = identity or User.query.filter_by(username=viewer_username).first()
     target = User.query.filter_by(username=target_username).first()
 
     if not viewer or not target:
@@ -271,31 +1548,28 @@ def follow_user():
                 following_id=target.id
             )
             db.session.add(new_follow)
-            db.session.commit()
-
-            # Realtime yangilash
-            socketio.emit('follow_update', {
-                'target': target_username,
-                'followers_count': Follow.query.filter_by(following_id=target.id).count()
-            }, broadcast=True)
-
+            bump_follow_counters(viewer.id, target.id, 1)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Parallel so'rov allaqachon follow qilgan
+                db.session.rollback()
+                return jsonify({"success": True, "action": "followed"})
+
+            emit_follow_update(viewer_username, target)
             return jsonify({"success": True, "action": "followed"})
 
     elif action == 'unfollow':
-        follow = Follow.query.filter_by(
+        deleted = Follow.query.filter_by(
             follower_id=viewer.id,
             following_id=target.id
-        ).first()
+        ).delete()
 
-        if follow:
-            db.session.delete(follow)
+        if deleted:
+            bump_follow_counters(viewer.id, target.id, -1)
             db.session.commit()
 
-            socketio.emit('follow_update', {
-                'target': target_username,
-                'followers_count': Follow.query.filter_by(following_id=target.id).count()
-            }, broadcast=True)
-
+            emit_follow_update(viewer_username, target)
             return jsonify({"success": True, "action": "unfollowed"})
 
     return jsonify({"error": "Amal bajarilmadi"}), 400
@@ -303,7 +1577,9 @@ def follow_user():
 @app.route('/api/user/block', methods=['POST'])
 def block_user():
     data = request.json
-    viewer_username = data['viewer']
+    viewer_username = acting_username(data.get('viewer'))
+    if not viewer_username:
+        return jsonify({"error": "Viewer talab qilinadi"}), 400
     target_username = data['target']
     action = data['action']  # 'block' yoki 'unblock'
 
@@ -311,54 +1587,128 @@ def block_user():
     if not target:
         return jsonify({"error": "Foydalanuvchi topilmadi"}), 404
 
-    blocked = target.blocked_users.split(',') if target.blocked_users else []
-
     if action == 'block':
-        if viewer_username not in blocked:
-            blocked.append(viewer_username)
-            target.blocked_users = ','.join(blocked)
+        if not Block.query.filter_by(blocker=viewer_username, blocked=target_username).first():
+            db.session.add(Block(blocker=viewer_username, blocked=target_username))
     else:
-        if viewer_username in blocked:
-            blocked.remove(viewer_username)
-            target.blocked_users = ','.join(blocked) if blocked else ''
+        Block.query.filter_by(blocker=viewer_username, blocked=target_username).delete()
 
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Parallel so'rov allaqachon bloklagan
+        db.session.rollback()
+    block_cache.invalidate(viewer_username)
 
-    # Realtime yangilash (ixtiyoriy)
-    socketio.emit('block_update', {
+    # Realtime yangilash (faqat ikki tomonga)
+    payload = {
         'target': target_username,
         'blocked_by': viewer_username,
         'is_blocked': action == 'block'
-    }, broadcast=True)
+    }
+    socketio.emit('block_update', payload, room=target_username)
+    socketio.emit('block_update', payload, room=viewer_username)
 
     return jsonify({"success": True})
 
 @app.route('/api/recent_chats', methods=['GET'])
 def get_recent_chats():
-    username = request.args.get('username')
+    username = acting_username(request.args.get('username'))
     if not username:
-        print("Xato: username yo'q")  # Log qo'shildi
+        hot_log.warning("Recent chats: username yo'q")
         return jsonify([]), 400
     
     try:
-        msgs = Message.query.filter(
-            (Message.sender == username) | (Message.receiver == username)
-        ).order_by(Message.timestamp.desc()).all()
+        contacts = [peer for (peer,) in db.session.query(Conversation.peer)
+                    .filter(Conversation.owner == username)
+                    .order_by(Conversation.last_time.desc())]
         
-        contacts = []
-        seen = set()
-        for m in msgs:
-            other_user = m.sender if m.sender != username else m.receiver
-            if other_user not in seen:
-                contacts.append(other_user)
-                seen.add(other_user)
-        
-        print(f"Recent chats for {username}: {contacts}")  # Log qo'shildi (tekshirish uchun)
+        hot_log.debug("Recent chats for %s: %d ta chat", username, len(contacts))
         return jsonify(contacts)
-    except Exception as e:
-        print(f"Recent chats xatosi: {e}")
+    except Exception:
+        log.exception("Recent chats xatosi")
         return jsonify([]), 500
 
+# --- PAROL XESHLASH (THREAD POOL) ---
+# scrypt/pbkdf2 CPU ni band qiladi va hub greenletida chaqirilsa, jarayondagi
+# barcha socketlar to'xtab qoladi. Shuning uchun xeshlash eventlet tpool
+# threadlarida bajariladi (hashlib GIL ni qo'yib yuboradi). Bir vaqtda ko'pi
+# bilan PASSWORD_HASH_WORKERS ta xesh hisoblanadi; navbat PASSWORD_HASH_QUEUE
+# dan oshsa yoki PASSWORD_HASH_WAIT ichida joy bo'shamasa, so'rov 503 bilan
+# qaytariladi (mijoz Retry-After dan keyin qayta urinadi).
+class HasherBusy(Exception):
+    pass
+
+class PasswordHasher:
+    def __init__(self, workers, max_queue, max_wait):
+        self.slots = eventlet.semaphore.Semaphore(workers)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.waiting = 0
+        self.running = 0
+        self.peak_waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.hash_seconds = 0.0
+
+    def _run(self, func, *args):
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HasherBusy()
+        queued_at = time.monotonic()
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            acquired = self.slots.acquire(timeout=self.max_wait)
+        finally:
+            self.waiting -= 1
+        if not acquired:
+            self.rejected += 1
+            raise HasherBusy()
+        started = time.monotonic()
+        self.wait_seconds += started - queued_at
+        self.running += 1
+        try:
+            return tpool.execute(func, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.hash_seconds += time.monotonic() - started
+            self.slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def stats(self):
+        return {
+            "waiting": self.waiting,
+            "running": self.running,
+            "peak_waiting": self.peak_waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.wait_seconds * 1000 / self.completed, 2) if self.completed else 0,
+            "avg_hash_ms": round(self.hash_seconds * 1000 / self.completed, 2) if self.completed else 0
+        }
+
+password_hasher = PasswordHasher(app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_QUEUE'],
+                                 app.config['PASSWORD_HASH_WAIT'])
+
+@app.errorhandler(HasherBusy)
+def hasher_busy(e):
+    return jsonify({"message": "Server band, birozdan keyin qayta urinib ko'ring"}), 503, {'Retry-After': '1'}
+
+@app.route('/api/admin/password_hasher')
+def password_hasher_stats():
+    return jsonify(password_hasher.stats())
+
+@app.route('/metrics')
+def metrics_api():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/register', methods=['POST'])
 def register_api():
     data = request.json
@@ -366,14 +1716,17 @@ def register_api():
         return jsonify({"message": "Bu username band!"}), 400
     if User.query.filter_by(phone=data['phone']).first():
         return jsonify({"message": "Bu telefon raqami ro'yxatdan o'tgan!"}), 400
-    hashed_p = generate_password_hash(data['password'])
+    hashed_p = password_hasher.hash(data['password'])
     new_user = User(
         username=data['username'],
         password=hashed_p,
         phone=data['phone']
     )
     db.session.add(new_user)
+    db.session.flush()
+    index_user(new_user)
     db.session.commit()
+    admin_stats.add('total', 1)
     return jsonify({"status": "success", "message": "Ro'yxatdan o'tdingiz!"}), 201
 
 @app.route('/api/login', methods=['POST'])
@@ -390,18 +1743,19 @@ def login_api():
         if not user and not u_name.endswith('.connect.uz'):
             user = User.query.filter_by(username=u_name + '.connect.uz').first()
         if user:
-            if check_password_hash(user.password, p_word):
-                user.is_online = True
-                try:
-                    db.session.commit()
-                except Exception as db_err:
-                    db.session.rollback()
-                    print(f"Database commit error: {db_err}")
+            if password_hasher.check(user.password, p_word):
+                if user.is_blocked:
+                    return jsonify({"message": "Hisobingiz bloklangan"}), 403
+                token = issue_session(user)
+                db.session.commit()
+                # Onlayn holat socket 'join' paytida presence orqali belgilanadi
                 return jsonify({
                 "status": "success",
+                "token": token,
                 "username": user.username,
                 "phone": user.phone,
                 "avatar": user.avatar or f"https://ui-avatars.com/api/?name={user.username}",
+                "avatar_thumb": user.avatar_thumb,
                 "bio": user.bio or "Bio hali yozilmagan",
                 "full_name": user.username  # Hozircha username ni full_name sifatida ishlatamiz
             }), 200
@@ -409,41 +1763,120 @@ def login_api():
                 return jsonify({"message": "Kiritilgan parol noto'g'ri!"}), 401
         else:
             return jsonify({"message": "Bunday foydalanuvchi mavjud emas!"}), 401
-    except Exception as e:
-        print(f"LOGIN_CRITICAL_ERROR: {e}")
+    except HasherBusy:
+        raise
+    except Exception:
+        log.exception("LOGIN_CRITICAL_ERROR")
         return jsonify({"message": "Serverda texnik xatolik yuz berdi"}), 500
 
 
 
+# --- TYPING INDIKATORI ---
+# Har bir tugma bosilishidagi typing_start/typing_stop to'g'ridan-to'g'ri
+# yuborilmaydi: holat xotirada saqlanadi va har TYPING_FLUSH_INTERVAL da faqat
+# o'zgargan xonalarga yuboriladi. Takroriy start faqat muddatni uzaytiradi,
+# stop kelmasa holat TYPING_TIMEOUT dan keyin o'chadi. Shaxsiy chatda qabul
+# qiluvchining xonasiga 'user_typing', guruhda esa guruh xonasiga bitta
+# umumlashgan 'group_typing' {group, count, users} yuboriladi.
+class TypingTracker:
+    def __init__(self):
+        self.active = {}   # (chat_type, xona) -> {sender: tugash vaqti}
+        self.sent = {}     # (chat_type, xona) -> oxirgi yuborilgan typistlar to'plami
+        self.dirty = set()
+
+    def start(self, sender, room, chat_type):
+        key = (chat_type, room)
+        typists = self.active.setdefault(key, {})
+        if sender not in typists:
+            self.dirty.add(key)
+        typists[sender] = time.monotonic() + app.config['TYPING_TIMEOUT']
+
+    def stop(self, sender, room, chat_type):
+        key = (chat_type, room)
+        if self.active.get(key, {}).pop(sender, None) is not None:
+            self.dirty.add(key)
+
+    def expire(self):
+        now = time.monotonic()
+        for key, typists in self.active.items():
+            stale = [s for s, until in typists.items() if until <= now]
+            for sender in stale:
+                del typists[sender]
+            if stale:
+                self.dirty.add(key)
+
+    def take_changes(self):
+        """O'zgargan xonalar: (chat_type, xona, hozirgi to'plam, oldingi to'plam)"""
+        changes = []
+        for key in self.dirty:
+            current = frozenset(self.active.get(key, ()))
+            previous = self.sent.get(key, frozenset())
+            if current != previous:
+                changes.append((key[0], key[1], current, previous))
+            if current:
+                self.sent[key] = current
+            else:
+                self.sent.pop(key, None)
+                self.active.pop(key, None)
+        self.dirty = set()
+        return changes
+
+typing_tracker = TypingTracker()
+_typing_task = None
+
+def flush_typing():
+    for chat_type, room, current, previous in typing_tracker.take_changes():
+        if chat_type == 'group':
+            socketio.emit('group_typing', {
+                'group': room,
+                'count': len(current),
+                'users': sorted(current)[:3]
+            }, room=room)
+        else:
+            for sender in current ^ previous:
+                socketio.emit('user_typing', {
+                    'sender': sender,
+                    'is_typing': sender in current
+                }, room=room)
+
+def _typing_loop():
+    while True:
+        time.sleep(app.config['TYPING_FLUSH_INTERVAL'])
+        typing_tracker.expire()
+        try:
+            flush_typing()
+        except Exception:
+            log.exception("TYPING_FLUSH_ERROR")
+
+def typing_target(data):
+    sender = acting_username(data.get('sender'))
+    receiver = data.get('receiver')
+    chat_type = 'group' if data.get('chat_type') == 'group' else 'private'
+    return sender, receiver, chat_type
+
 # Typing indikatori (chatda yozish boshlanganda)
 @socketio.on('typing_start')
 def handle_typing_start(data):
-    sender = data['sender']
-    receiver = data['receiver']
-    
-    # Faqat shu suhbatdoshga yuboriladi
-    emit('user_typing', {
-        'sender': sender,
-        'is_typing': True
-    }, room=receiver)
+    global _typing_task
+    sender, receiver, chat_type = typing_target(data)
+    if not sender or not receiver: return
+    if _typing_task is None:
+        _typing_task = socketio.start_background_task(_typing_loop)
+    typing_tracker.start(sender, receiver, chat_type)
 
 # Typing to‘xtaganida
 @socketio.on('typing_stop')
 def handle_typing_stop(data):
-    sender = data['sender']
-    receiver = data['receiver']
-    
-    emit('user_typing', {
-        'sender': sender,
-        'is_typing': False
-    }, room=receiver)
+    sender, receiver, chat_type = typing_target(data)
+    if not sender or not receiver: return
+    typing_tracker.stop(sender, receiver, chat_type)
 
 @app.route('/api/add_member', methods=['POST'])
 def add_member():
     data = request.json
     group_name = data.get('group')
     username = data.get('username')
-    added_by = data.get('added_by')  # kim qo‘shayotgani
+    added_by = acting_username(data.get('added_by'))  # kim qo‘shayotgani
 
     if not group_name or not username:
         return jsonify({"status": "error", "message": "Ma'lumot yetarli emas"}), 400
@@ -472,7 +1905,10 @@ def add_member():
         role='member'
     )
     db.session.add(new_member)
+    open_group_conversation(username, entity.name)
     db.session.commit()
+    entity_directory.invalidate()
+    room_cache.invalidate(username)
 
     # Realtime yangilash
     socketio.emit('member_added', {
@@ -493,7 +1929,9 @@ def admin_edit_user():
     if user:
         user.username = data.get('name', user.username)
         user.bio = data.get('bio', user.bio)
+        index_user(user)
         db.session.commit()
+        refresh_user_sessions(user.id)
         socketio.emit('user_update', {
             "userId": user.username,
             "updatedFields": {"name": user.username, "bio": user.bio}
@@ -508,12 +1946,8 @@ def delete_user_admin():
         return jsonify({"m": "No"}), 403
     user = User.query.filter_by(username=data.get('target')).first()
     if user:
-        Message.query.filter(
-            (Message.sender == user.username) | (Message.receiver == user.username)
-        ).delete()
-        db.session.delete(user)
-        db.session.commit()
-        return jsonify({"status": "success"})
+        job = schedule_user_deletion(user, data.get('admin'))
+        return jsonify({"status": "success", "job_id": job.id})
     return jsonify({"status": "error"}), 404
 
 @socketio.on('admin_broadcast')
@@ -533,6 +1967,8 @@ def admin_block_user():
     user = User.query.filter_by(username=data['username']).first()
     if user:
         user.is_blocked = not user.is_blocked
+        if user.is_blocked:
+            revoke_sessions(user.id)
         db.session.commit()
         return jsonify({"message": "Muvaffaqiyatli!"}), 200
     return jsonify({"message": "User topilmadi"}), 404
@@ -550,15 +1986,34 @@ def get_messages():
     u2 = request.args.get('user2')
     if not u1 or not u2:
         return jsonify({"message": "Foydalanuvchilar ko'rsatilmadi"}), 400
+    before_id = request.args.get('before_id', type=int)
+    after_id = request.args.get('after_id', type=int)
+    limit = min(request.args.get('limit', app.config['MESSAGES_PAGE_SIZE'], type=int),
+                app.config['MESSAGES_PAGE_MAX'])
+    full_history = request.args.get('all') == '1'
     try:
         is_entity = Entity.query.filter_by(name=u2).first()
         if is_entity:
-            msgs = Message.query.filter_by(receiver=u2).order_by(Message.timestamp.asc()).all()
+            branches = [Message.receiver == u2]
+        else:
+            branches = [(Message.sender == u1) & (Message.receiver == u2),
+                        (Message.sender == u2) & (Message.receiver == u1)]
+            # Hali tozalanayotgan o'chirilgan tarix ko'rsatilmaydi
+            cutoff = deletion_cutoff(u1, u2)
+            if cutoff:
+                branches = [cond & (Message.id > cutoff) for cond in branches]
+
+        if full_history:
+            # Eski xatti-harakat: butun tarix (faqat aniq so'ralganda)
+            msgs = Message.query.filter(db.or_(*branches)).order_by(Message.id.asc()).all()
         else:
-            msgs = Message.query.filter(
-                ((Message.sender == u1) & (Message.receiver == u2)) |
-                ((Message.sender == u2) & (Message.receiver == u1))
-            ).order_by(Message.timestamp.asc()).all()
+            msgs = fetch_message_page(branches, before_id, after_id, max(limit, 1))
+
+        # Suhbat ochildi: o'qilmaganlar hisoblagichini nolga tushirish
+        if Conversation.query.filter(Conversation.owner == u1, Conversation.peer == u2,
+                                     Conversation.unread_count > 0).update(
+                {'unread_count': 0}, synchronize_session=False):
+            db.session.commit()
         
         result = []
         for m in msgs:
@@ -579,8 +2034,8 @@ def get_messages():
                 "reply_to": reply_to_obj
             })
         return jsonify(result)
-    except Exception as e:
-        print(f"Xabarlarni yuklashda xato: {e}")
+    except Exception:
+        log.exception("Xabarlarni yuklashda xato")
         return jsonify({"message": "Xabarlarni yuklab bo'lmadi"}), 500
 
 @app.route('/api/apply', methods=['POST'])
@@ -595,30 +2050,109 @@ def submit_apply():
     db.session.commit()
     return jsonify({"status": "success"})
 
+# --- ADMIN STATISTIKASI ---
+# Hisoblagichlar har so'rovda COUNT(*) qilinmaydi: ular yozish yo'llarida
+# (ro'yxatdan o'tish, xabar saqlash/o'chirish, guruh yaratish) yangilanadi va
+# o'qilganda STATS_RECONCILE_INTERVAL dan eski bo'lsa bazadan qayta hisoblanadi
+# (boshqa workerlar yozganlari ham shunda qo'shiladi). Xabar tezligi oxirgi 60 soniyadagi
+# sekundlik savatlardan olinadi. 'admin_stats_subscribe' qilgan socketlar
+# 'admin_stats' xonasiga kiradi va har STATS_PUSH_INTERVAL da faqat
+# o'zgargan maydonlarni oladi.
+class AdminStats:
+    def __init__(self):
+        self.counts = None  # {'total', 'messages', 'groups'}; None - hali yuklanmagan
+        self.per_second = {}  # unix sekund -> saqlangan xabarlar soni
+        self.last_sent = {}
+        self.last_reconcile = 0.0
+        self.task = None
+
+    def reconcile(self):
+        with app.app_context():
+            self.counts = {
+                'total': User.query.count(),
+                'messages': Message.query.count(),
+                'groups': Entity.query.filter_by(type='group').count()
+            }
+        self.last_reconcile = time.monotonic()
+
+    def add(self, key, delta):
+        # Yuklanmagan bo'lsa, birinchi reconcile bu o'zgarishni ham sanaydi
+        if self.counts is not None:
+            self.counts[key] += delta
+
+    def record_messages(self, n):
+        if not n:
+            return
+        self.add('messages', n)
+        now = int(time.time())
+        self.per_second[now] = self.per_second.get(now, 0) + n
+        if len(self.per_second) > 120:
+            for second in [s for s in self.per_second if s <= now - 60]:
+                del self.per_second[second]
+
+    def messages_per_minute(self):
+        since = int(time.time()) - 60
+        return sum(n for second, n in self.per_second.items() if second > since)
+
+    def snapshot(self):
+        # Obunachi bo'lmasa ham, boshqa workerlar yozganlari o'qishda qo'shiladi
+        if self.counts is None or \
+                time.monotonic() - self.last_reconcile >= app.config['STATS_RECONCILE_INTERVAL']:
+            self.reconcile()
+        return {
+            "total": self.counts['total'],
+            "online": presence.online_count(),
+            "messages": self.counts['messages'],
+            "groups": self.counts['groups'],
+            "messages_per_minute": self.messages_per_minute(),
+            "server_time": datetime.utcnow().strftime('%H:%M:%S')
+        }
+
+    def push(self):
+        current = self.snapshot()
+        changes = {k: v for k, v in current.items() if k != 'server_time' and self.last_sent.get(k) != v}
+        if changes:
+            self.last_sent.update(changes)
+            changes['server_time'] = current['server_time']
+            socketio.emit('admin_stats', changes, room='admin_stats')
+
+    def _loop(self):
+        while True:
+            time.sleep(app.config['STATS_PUSH_INTERVAL'])
+            try:
+                self.push()
+            except Exception:
+                log.exception("ADMIN_STATS_ERROR")
+
+    def ensure_loop(self):
+        if self.task is None:
+            self.task = socketio.start_background_task(self._loop)
+
+admin_stats = AdminStats()
+
 @app.route('/api/admin/stats')
 def get_admin_stats():
-    total_users = User.query.count()
-    total_messages = Message.query.count()
-    total_groups = Entity.query.filter_by(type='group').count()
-    online_now = User.query.filter_by(is_online=True).count()
-    return jsonify({
-        "total": total_users,
-        "online": online_now,
-        "messages": total_messages,
-        "groups": total_groups,
-        "server_time": datetime.utcnow().strftime('%H:%M:%S')
-    })
+    return jsonify(admin_stats.snapshot())
+
+@socketio.on('admin_stats_subscribe')
+def handle_admin_stats_subscribe(data=None):
+    join_room('admin_stats')
+    admin_stats.ensure_loop()
+    # Birinchi marta to'liq holat, keyin faqat o'zgarishlar
+    emit('admin_stats', admin_stats.snapshot(), to=request.sid)
 
 @app.route('/api/update_profile', methods=['POST'])
 def update_profile():
     data = request.json
-    user = User.query.filter_by(username=data.get('username')).first()
+    user = User.query.filter_by(username=acting_username(data.get('username'))).first()
     if user:
         field = data.get('field')
         value = data.get('value')
         if field == 'name': user.username = value
         if field == 'bio': user.bio = value
+        index_user(user)
         db.session.commit()
+        refresh_user_sessions(user.id)
         return jsonify({"success": True})
     return jsonify({"success": False}), 404
 
@@ -632,40 +2166,460 @@ def update_user():
     if User.query.filter_by(username=new_username).first():
         return jsonify({"message": "Bu username band!"}), 400
     user.username = new_username
+    index_user(user)
     db.session.commit()
+    refresh_user_sessions(user.id)
     return jsonify({"status": "success"})
 
 @app.route('/api/update_password', methods=['POST'])
 def update_password():
     data = request.json
-    user = User.query.filter_by(username=data.get('username')).first()
+    user = User.query.filter_by(username=acting_username(data.get('username'))).first()
     if user:
-        user.password = generate_password_hash(data.get('password'))
+        user.password = password_hasher.hash(data.get('password'))
+        # Boshqa barcha qurilmalardagi sessiyalar yopiladi, joriysi yangilanadi
+        revoke_sessions(user.id)
+        token = issue_session(user)
         db.session.commit()
-        return jsonify({"status": "success"})
+        return jsonify({"status": "success", "token": token})
     return jsonify({"message": "Xato!"}), 400
 
 @app.route('/api/users/search', methods=['GET'])
 def search_users():
-    users = User.query.all()
+    q = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    if q:
+        users = search_users_ranked(q, limit, offset)
+    else:
+        users = User.query.order_by(User.id).limit(limit).offset(offset).all()
     return jsonify([{"username": u.username, "is_blocked": u.is_blocked} for u in users])
 
+@app.route('/api/messages/search', methods=['GET'])
+def search_messages():
+    username = acting_username(request.args.get('username'))
+    q = request.args.get('q', '').strip()
+    if not username or not q:
+        return jsonify([])
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    return jsonify([{
+        "id": m.id,
+        "sender": m.sender,
+        "receiver": m.receiver,
+        "content": m.content,
+        "type": m.msg_type,
+        "timestamp": m.timestamp.strftime('%H:%M')
+    } for m in search_messages_ranked(username, q, limit, offset)])
+
 @app.route('/api/upload_avatar', methods=['POST'])
 def upload_avatar():
     if 'file' not in request.files:
         return jsonify({"message": "Fayl topilmadi"}), 400
     file = request.files['file']
     u_name = request.form.get('username')
+    if file and file.filename.rsplit('.', 1)[-1].lower() not in ALLOWED_IMAGE_EXTENSIONS:
+        return jsonify({"message": "Rasm formati ruxsat etilmagan"}), 400
     if file and u_name:
-        filename = secure_filename(f"avatar_{u_name}_{file.filename}")
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'media', filename)
-        file.save(filepath)
         user = User.query.filter_by(username=u_name).first()
-        user.avatar = f"/uploads/media/{filename}"
-        db.session.commit()
-        return jsonify({"status": "success", "url": user.avatar})
+        if not user:
+            return jsonify({"message": "User topilmadi"}), 404
+        tmp_path = os.path.join(app.config['UPLOAD_TMP_FOLDER'], secrets.token_hex(16) + '.part')
+        digest = hashlib.sha256()
+        with open(tmp_path, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(UPLOAD_BUFFER_SIZE), b''):
+                digest.update(chunk)
+                out.write(chunk)
+        stored = store_content_addressed(tmp_path, digest.hexdigest(), file.filename)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            stored = StoredFile.query.get(stored.sha256)
+        processing = set_avatar(u_name, stored)
+        return jsonify({"status": "success", "url": stored_file_url(stored), "processing": processing})
     return jsonify({"message": "Xato"}), 400
 
+# --- BO'LAKLAB YUKLASH (RESUMABLE UPLOAD) ---
+# 1. POST /api/uploads {username, filename, size, sha256, kind}: shu sha256
+#    allaqachon omborda bo'lsa, yuklashsiz darhol tayyor URL qaytadi.
+# 2. PUT /api/uploads/<id>?offset=N: bo'lak request.stream dan to'g'ridan-to'g'ri
+#    .part faylga UPLOAD_BUFFER_SIZE lik bo'laklarda yoziladi (xotira cheklangan).
+# 3. GET /api/uploads/<id>: uzilishdan keyin qayerdan davom etish (received).
+# Oxirgi bo'lakdan keyin sha256 tekshiriladi va fayl cas/<ab>/<sha256>.<ext>
+# ga ko'chiriladi.
+UPLOAD_BUFFER_SIZE = 64 * 1024
+
+def stored_file_url(stored):
+    return f"/uploads/{stored.path}"
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def store_content_addressed(tmp_path, sha256, filename):
+    """Tekshirilgan faylni omborga ko'chirish; bunday baytlar bo'lsa, nusxa olinmaydi"""
+    existing = StoredFile.query.get(sha256)
+    if existing:
+        os.remove(tmp_path)
+        return existing
+    ext = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    rel_path = f"cas/{sha256[:2]}/{sha256}{ext}"
+    dest = os.path.join(app.config['UPLOAD_FOLDER'], rel_path)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    os.replace(tmp_path, dest)
+    stored = StoredFile(sha256=sha256, path=rel_path, size=os.path.getsize(dest))
+    db.session.add(stored)
+    return stored
+
+def upload_part_path(upload_id):
+    return os.path.join(app.config['UPLOAD_TMP_FOLDER'], f"{upload_id}.part")
+
+def finish_upload(session, stored):
+    kind, username = session.kind, session.username
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Xuddi shu fayl parallel ravishda saqlandi
+        db.session.rollback()
+        stored = StoredFile.query.get(stored.sha256)
+    # .part fayl allaqachon ko'chirilgan: sessiya alohida commit bilan o'chiriladi,
+    # yuqoridagi rollback uni qaytarib qo'ymaydi
+    db.session.delete(session)
+    db.session.commit()
+    if kind == 'avatar':
+        set_avatar(username, stored)
+    return jsonify({"status": "complete", "url": stored_file_url(stored), "size": stored.size})
+
+def expire_upload_sessions():
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['UPLOAD_SESSION_TTL'])
+    for old in UploadSession.query.filter(UploadSession.created_at < cutoff).all():
+        if os.path.exists(upload_part_path(old.id)):
+            os.remove(upload_part_path(old.id))
+        db.session.delete(old)
+
+@app.route('/api/uploads', methods=['POST'])
+def init_upload():
+    data = request.json or {}
+    username = acting_username(data.get('username'))
+    filename = data.get('filename') or ''
+    kind = data.get('kind', 'media')
+    sha256 = str(data.get('sha256', '')).lower()
+    size = data.get('size')
+    if not username or not isinstance(size, int) or not re.fullmatch(r'[0-9a-f]{64}', sha256):
+        return jsonify({"message": "Ma'lumot yetarli emas"}), 400
+    if size <= 0 or size > app.config['UPLOAD_MAX_SIZE']:
+        return jsonify({"message": "Fayl hajmi ruxsat etilmagan"}), 413
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if kind not in UPLOAD_KINDS:
+        return jsonify({"message": "Yuklash turi noto'g'ri"}), 400
+    if ext not in UPLOAD_KINDS[kind]:
+        return jsonify({"message": "Fayl formati ruxsat etilmagan"}), 400
+
+    # Bir xil baytlar allaqachon bor: darhol tayyor
+    stored = StoredFile.query.get(sha256)
+    if stored:
+        if kind == 'avatar':
+            set_avatar(username, stored)
+        return jsonify({"status": "complete", "url": stored_file_url(stored), "size": stored.size})
+
+    expire_upload_sessions()
+    session = UploadSession(id=secrets.token_hex(16), username=username, filename=filename,
+                            kind=kind, size=size, sha256=sha256)
+    db.session.add(session)
+    db.session.commit()
+    open(upload_part_path(session.id), 'wb').close()
+    return jsonify({"status": "pending", "upload_id": session.id, "received": 0, "size": size}), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    session = UploadSession.query.get(upload_id)
+    if not session:
+        return jsonify({"message": "Yuklash topilmadi"}), 404
+    return jsonify({"upload_id": session.id, "received": os.path.getsize(upload_part_path(session.id)),
+                    "size": session.size})
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    session = UploadSession.query.get(upload_id)
+    if not session:
+        return jsonify({"message": "Yuklash topilmadi"}), 404
+    part_path = upload_part_path(session.id)
+    received = os.path.getsize(part_path)
+    offset = request.args.get('offset', type=int)
+    if offset != received:
+        # Mijoz qayerdan davom etishni shu javobdan biladi
+        return jsonify({"message": "Noto'g'ri offset", "received": received}), 409
+
+    with open(part_path, 'ab') as out:
+        while True:
+            chunk = request.stream.read(UPLOAD_BUFFER_SIZE)
+            if not chunk:
+                break
+            if received + len(chunk) > session.size:
+                out.truncate(offset)
+                return jsonify({"message": "Fayl hajmidan oshib ketdi", "received": offset}), 413
+            out.write(chunk)
+            received += len(chunk)
+
+    if received < session.size:
+        return jsonify({"status": "pending", "received": received, "size": session.size})
+
+    if file_sha256(part_path) != session.sha256:
+        os.remove(part_path)
+        db.session.delete(session)
+        db.session.commit()
+        return jsonify({"message": "Fayl buzilgan (sha256 mos emas)"}), 422
+    stored = store_content_addressed(part_path, session.sha256, session.filename)
+    return finish_upload(session, stored)
+
+# --- RASMLARNI QAYTA ISHLASH (AVATAR VARIANTLARI) ---
+# Asl rasm omborga saqlanadi, variantlarni esa IMAGE_WORKERS ta fon vazifasi
+# yasaydi: Pillow ishi eventlet tpool (OS thread) da bajariladi, so'rov va
+# hub greenletlari kutmaydi. Har bir variant kvadratga kesiladi, EXIF/ICC
+# tashlanadi va WebP sifatida omborga yoziladi. Foydalanuvchida faqat variant
+# URL lari saqlanadi; tayyor bo'lganda egasining xonasiga 'avatar_ready' ketadi.
+# Pillow o'rnatilmagan bo'lsa, avatar sifatida asl fayl URL i yoziladi.
+AVATAR_VARIANTS = {'thumb': 64, 'medium': 256}
+AVATAR_QUALITY = 80
+AVATAR_MAX_PIXELS = 40 * 1000 * 1000
+_image_jobs = eventlet.queue.LightQueue()
+_image_workers_started = False
+_avatar_pending = {}  # username -> oxirgi yuklangan asl rasmning sha256 i
+
+def render_avatar_variants(src_path):
+    """Asl rasmdan variant baytlarini yasash (tpool threadida ishlaydi)"""
+    with Image.open(src_path) as img:
+        if img.width * img.height > AVATAR_MAX_PIXELS:
+            raise ValueError(f"rasm juda katta: {img.width}x{img.height}")
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+        variants = {}
+        for name, size in AVATAR_VARIANTS.items():
+            variant = ImageOps.fit(img, (size, size), Image.LANCZOS)
+            variant.info = {}  # metadata variantga o'tmasin
+            buf = io.BytesIO()
+            variant.save(buf, 'WEBP', quality=AVATAR_QUALITY, method=4)
+            variants[name] = buf.getvalue()
+    return variants
+
+def store_bytes(data, ext):
+    sha256 = hashlib.sha256(data).hexdigest()
+    tmp_path = os.path.join(app.config['UPLOAD_TMP_FOLDER'], secrets.token_hex(16) + '.part')
+    with open(tmp_path, 'wb') as out:
+        out.write(data)
+    stored = store_content_addressed(tmp_path, sha256, 'file' + ext)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        stored = StoredFile.query.get(sha256)
+    return stored
+
+def process_avatar(username, sha256):
+    """Variantlarni yasab, foydalanuvchiga yozish"""
+    with app.app_context():
+        stored = StoredFile.query.get(sha256)
+        try:
+            variants = tpool.execute(render_avatar_variants,
+                                     os.path.join(app.config['UPLOAD_FOLDER'], stored.path))
+        except Exception:
+            log.exception("AVATAR_ERROR (%s)", username)
+            _avatar_pending.pop(username, None)
+            socketio.emit('avatar_failed', {'username': username}, room=username)
+            return
+        urls = {name: stored_file_url(store_bytes(data, '.webp')) for name, data in variants.items()}
+        # Shu orada yangisi yuklangan bo'lsa, eskisini yozmaymiz
+        if _avatar_pending.get(username, sha256) != sha256:
+            return
+        _avatar_pending.pop(username, None)
+        User.query.filter_by(username=username).update(
+            {'avatar': urls['medium'], 'avatar_thumb': urls['thumb']}, synchronize_session=False)
+        db.session.commit()
+        socketio.emit('avatar_ready', {
+            'username': username, 'avatar': urls['medium'], 'avatar_thumb': urls['thumb']
+        }, room=username)
+
+def _image_worker():
+    while True:
+        username, sha256 = _image_jobs.get()
+        try:
+            process_avatar(username, sha256)
+        except Exception:
+            log.exception("IMAGE_WORKER_ERROR")
+
+def set_avatar(username, stored):
+    """Yangi avatarni navbatga qo'yish. Variantlar yasalsa True qaytadi"""
+    global _image_workers_started
+    if Image is None:
+        User.query.filter_by(username=username).update(
+            {'avatar': stored_file_url(stored), 'avatar_thumb': None}, synchronize_session=False)
+        db.session.commit()
+        return False
+    if not _image_workers_started:
+        _image_workers_started = True
+        for _ in range(app.config['IMAGE_WORKERS']):
+            socketio.start_background_task(_image_worker)
+    _avatar_pending[username] = stored.sha256
+    _image_jobs.put((username, stored.sha256))
+    return True
+
+def migrate_inline_avatars():
+    """avatar ustunidagi data: URI larni omborga ko'chirib, variantlarini yasash"""
+    rows = db.session.query(User.username, User.avatar).filter(User.avatar.like('data:%')).all()
+    for username, avatar in rows:
+        try:
+            header, encoded = avatar.split(',', 1)
+            data = base64.b64decode(encoded, validate=True)
+        except (ValueError, binascii.Error):
+            data = b''
+        if not data:
+            User.query.filter_by(username=username).update({'avatar': None}, synchronize_session=False)
+            continue
+        ext = mimetypes.guess_extension(header[5:].split(';', 1)[0]) or ''
+        stored = store_bytes(data, ext)
+        User.query.filter_by(username=username).update(
+            {'avatar': stored_file_url(stored)}, synchronize_session=False)
+        db.session.commit()
+        if Image is not None:
+            process_avatar(username, stored.sha256)
+
+# --- ONLAYN HOLAT (PRESENCE) ---
+# Kim onlayn ekanligi bazada emas, jarayon xotirasida saqlanadi: sid -> user
+# va user -> {sid}. Bir foydalanuvchining bir nechta sessiyasi bo'lishi
+# mumkin, oxirgisi yopilganda u oflayn hisoblanadi. Holat o'zgarishlari
+# obunachilarga va last_seen bazaga har PRESENCE_FLUSH_INTERVAL da to'plab
+# yuboriladi. Bir nechta worker bo'lsa, har biri faqat o'z ulanishlarini biladi.
+class PresenceTracker:
+    def __init__(self):
+        self.sid_user = {}
+        self.user_sids = {}
+        self.last_beat = {}
+        self.changes = {}    # username -> True (onlayn) / False (oflayn)
+        self.last_seen = {}  # username -> datetime, hali bazaga yozilmagan
+        self.expired = {}    # sid -> username: heartbeat kechikkan, lekin socket hali ulangan
+
+    def connect(self, sid, username):
+        old = self.sid_user.get(sid)
+        if old == username:
+            self.heartbeat(sid)
+            return
+        if old:
+            self.disconnect(sid)
+        self.sid_user[sid] = username
+        self.last_beat[sid] = time.monotonic()
+        sids = self.user_sids.setdefault(username, set())
+        sids.add(sid)
+        if len(sids) == 1:
+            self.changes[username] = True
+
+    def disconnect(self, sid):
+        self.expired.pop(sid, None)
+        username = self.sid_user.pop(sid, None)
+        self.last_beat.pop(sid, None)
+        if username is None:
+            return None
+        sids = self.user_sids.get(username)
+        if sids:
+            sids.discard(sid)
+        if not sids:
+            self.user_sids.pop(username, None)
+            self.last_seen[username] = datetime.utcnow()
+            self.changes[username] = False
+        return username
+
+    def drop_user(self, username):
+        for sid in list(self.user_sids.get(username, ())):
+            self.disconnect(sid)
+        for sid in [sid for sid, user in self.expired.items() if user == username]:
+            del self.expired[sid]
+
+    def heartbeat(self, sid):
+        if sid in self.last_beat:
+            self.last_beat[sid] = time.monotonic()
+        elif sid in self.expired:
+            # Muddati o'tgan, lekin uzilmagan socket qayta onlayn bo'ladi
+            self.connect(sid, self.expired.pop(sid))
+
+    def expire(self, timeout):
+        cutoff = time.monotonic() - timeout
+        for sid in [sid for sid, beat in self.last_beat.items() if beat < cutoff]:
+            username = self.disconnect(sid)
+            if username:
+                self.expired[sid] = username
+
+    def is_online(self, username):
+        return username in self.user_sids
+
+    def online_count(self):
+        return len(self.user_sids)
+
+    def take_pending(self):
+        changes, self.changes = self.changes, {}
+        last_seen, self.last_seen = self.last_seen, {}
+        return changes, last_seen
+
+presence = PresenceTracker()
+_presence_task = None
+
+def flush_presence():
+    """To'plangan last_seen qiymatlarini saqlash va obunachilarga holatni yuborish"""
+    changes, last_seen = presence.take_pending()
+    if not changes and not last_seen:
+        return
+    with app.app_context():
+        if last_seen:
+            users = User.__table__
+            db.session.execute(
+                db.update(users).where(users.c.username == db.bindparam('u_name'))
+                .values(last_seen=db.bindparam('seen_at')),
+                [{'u_name': u, 'seen_at': t} for u, t in last_seen.items()]
+            )
+            db.session.commit()
+
+        # Har bir obunachiga bitta 'presence_update': kimlar onlayn/oflayn bo'ldi
+        per_follower = {}
+        names = list(changes)
+        Target = db.aliased(User)
+        for i in range(0, len(names), 500):
+            rows = db.session.query(Target.username, User.username) \
+                .join(Follow, Follow.following_id == Target.id) \
+                .join(User, User.id == Follow.follower_id) \
+                .filter(Target.username.in_(names[i:i + 500])).all()
+            for target, follower in rows:
+                entry = per_follower.setdefault(follower, {'online': [], 'offline': []})
+                entry['online' if changes[target] else 'offline'].append(target)
+    for follower, payload in per_follower.items():
+        socketio.emit('presence_update', payload, room=follower)
+
+def _presence_loop():
+    while True:
+        time.sleep(app.config['PRESENCE_FLUSH_INTERVAL'])
+        presence.expire(app.config['PRESENCE_TIMEOUT'])
+        try:
+            flush_presence()
+        except Exception:
+            log.exception("PRESENCE_FLUSH_ERROR")
+
+def ensure_presence_loop():
+    global _presence_task
+    if _presence_task is None:
+        _presence_task = socketio.start_background_task(_presence_loop)
+
+atexit.register(flush_presence)
+
+@app.route('/api/presence')
+def get_presence():
+    names = [n for n in request.args.get('users', '').split(',') if n][:200]
+    return jsonify({n: presence.is_online(n) for n in names})
+
+@socketio.on('presence_ping')
+def handle_presence_ping(data=None):
+    presence.heartbeat(request.sid)
 
 @socketio.on('join_private_chat')
 def join_private_chat(data):
@@ -674,27 +2628,36 @@ def join_private_chat(data):
     room = data.get('room')  # Frontenddan yuborilgan room nomi
 
     if not user1 or not user2 or not room:
-        print("Xato: join_private_chat uchun ma'lumot yetarli emas")
+        hot_log.warning("join_private_chat uchun ma'lumot yetarli emas")
         return
 
     join_room(room)
-    print(f"{user1} {user2} bilan shaxsiy chatga qo'shildi: {room}")
+    hot_log.info("%s %s bilan shaxsiy chatga qo'shildi: %s", user1, user2, room)
+
+@socketio.on('connect')
+def handle_connect(auth=None):
+    token = auth.get('token') if isinstance(auth, dict) else None
+    if token and bind_socket_session(request.sid, token):
+        return
+    if app.config['SESSION_REQUIRED']:
+        return False
 
 @socketio.on('join')
 def handle_join(data):
-    username = data.get('username')
+    # Socket login dan oldin ulangan bo'lsa, token shu yerda bog'lanadi
+    if data.get('token'):
+        bind_socket_session(request.sid, data['token'])
+    username = acting_username(data.get('username'))
     if not username: return
     
     # Foydalanuvchini o'z nomi bilan atalgan xonaga qo'shish (bildirishnomalar uchun)
     join_room(username)
+    presence.connect(request.sid, username)
+    ensure_presence_loop()
     
-    # Foydalanuvchi a'zo bo'lgan barcha guruhlarga qo'shish
-    memberships = EntityMember.query.filter_by(username=username).all()
-    for m in memberships:
-        entity = Entity.query.get(m.entity_id)
-        if entity and entity.type == 'group':
-            join_room(entity.name)
-            print(f"User {username} joined group: {entity.name}")
+    # Foydalanuvchi a'zo bo'lgan barcha guruhlarga qo'shish (keshdan)
+    for room in room_cache.get(username):
+        join_room(room)
 
 # Shaxsiy chatga kirganda xonani yaratish
 @socketio.on('join_private_chat')
@@ -704,55 +2667,212 @@ def handle_join_private(data):
     if user1 and user2:
         room = '_'.join(sorted([user1, user2]))
         join_room(room)
-        print(f"✅ {user1} va {user2} xonaga ulandi: {room}")
+        hot_log.info("%s va %s xonaga ulandi: %s", user1, user2, room)
+
+# --- XABARLARNI GURUHLAB SAQLASH (GROUP COMMIT) ---
+# 'batch' rejimida send_message xabarlari navbatga tushadi va alohida writer
+# greenlet ularni MESSAGE_BATCH_SIZE tagacha yoki MESSAGE_BATCH_DELAY
+# ichida bitta tranzaksiyada saqlaydi. Xabar xonaga va 'message_ack' sifatida
+# yuboruvchiga faqat uning to'plami commit bo'lgandan keyin yuboriladi:
+# ack kelmagan xabar saqlanmagan deb hisoblanadi (jarayon to'satdan
+# to'xtasa, oxirgi kechikish oynasidagi ack qilinmagan xabarlar yo'qoladi).
+# 'sync' rejimi har bir xabarni handler ichida darhol commit qiladi.
+_outbox = eventlet.queue.LightQueue()
+_message_writer_task = None
+
+def _persist_messages(batch):
+    msgs = []
+    for item in batch:
+        msg = Message(
+            sender=item['sender'],
+            receiver=item['receiver'],
+            content=item['content'],
+            msg_type=item['type'],
+            timestamp=item['timestamp']
+        )
+        db.session.add(msg)
+        msgs.append(msg)
+    db.session.flush()
+    for msg, item in zip(msgs, batch):
+        touch_conversations(msg, is_entity=item['chat_type'] != 'private')
+    index_messages(msgs)
+    db.session.commit()
+    return msgs
+
+def _deliver_message(msg, item):
+    message_data = {
+        'id': msg.id,
+        'sender': msg.sender,
+        'receiver': msg.receiver,
+        'content': msg.content,
+        'type': msg.msg_type,
+        'timestamp': msg.timestamp.strftime('%H:%M')
+    }
+    if item['chat_type'] == 'group':
+        # Guruhlarda xona nomi guruhning nomi bilan bir xil
+        room = msg.receiver
+    else:
+        # Shaxsiy chatda xona nomi: user1_user2
+        room = '_'.join(sorted([msg.sender, msg.receiver]))
+    if room_batcher.enabled_for(item['chat_type']):
+        room_batcher.add(room, message_data)
+    else:
+        socketio.emit('receive_message', message_data, room=room)
+    if item['sid']:
+        socketio.emit('message_ack', {'id': msg.id, 'client_id': item['client_id']}, to=item['sid'])
+
+def write_messages(batch):
+    """Xabarlar to'plamini bitta commit bilan saqlash, keyin yetkazish"""
+    with app.app_context():
+        try:
+            saved = list(zip(_persist_messages(batch), batch))
+        except Exception:
+            db.session.rollback()
+            log.exception("BATCH_WRITE_ERROR")
+            # Bitta buzuq xabar butun to'plamni yo'qotmasligi uchun alohida saqlaymiz
+            saved = []
+            for item in batch:
+                try:
+                    saved.append((_persist_messages([item])[0], item))
+                except Exception:
+                    db.session.rollback()
+                    if item['sid']:
+                        socketio.emit('message_failed', {'client_id': item['client_id']}, to=item['sid'])
+        admin_stats.record_messages(len(saved))
+        for msg, item in saved:
+            # Xabar saqlangan; bitta yetkazish xatosi qolganlarini to'xtatmasin
+            try:
+                _deliver_message(msg, item)
+            except Exception:
+                log.exception("DELIVER_ERROR (message %s)", msg.id)
+
+def _message_writer():
+    global _message_writer_task
+    size = app.config['MESSAGE_BATCH_SIZE']
+    delay = app.config['MESSAGE_BATCH_DELAY']
+    try:
+        while True:
+            batch = [_outbox.get()]
+            deadline = time.monotonic() + delay
+            while len(batch) < size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(_outbox.get(timeout=remaining))
+                except eventlet.queue.Empty:
+                    break
+            try:
+                write_messages(batch)
+            except Exception:
+                log.exception("MESSAGE_WRITER_ERROR")
+    finally:
+        # Writer to'xtasa, keyingi enqueue_message uni qayta ishga tushiradi
+        _message_writer_task = None
+
+def enqueue_message(item):
+    global _message_writer_task
+    if _message_writer_task is None:
+        _message_writer_task = socketio.start_background_task(_message_writer)
+    _outbox.put(item)
+
+@atexit.register
+def flush_outbox():
+    """To'xtashda navbatda qolgan xabarlarni saqlab qo'yish"""
+    batch = []
+    while not _outbox.empty():
+        batch.append(_outbox.get_nowait())
+    if batch:
+        write_messages(batch)
+
+# --- XONAGA TO'PLAB YETKAZISH ---
+# Gavjum guruhlarda har bir xabar uchun alohida paket o'rniga xona bo'yicha
+# bufer yig'iladi va ROOM_BATCH_DELAY da (yoki ROOM_BATCH_SIZE ga yetganda)
+# bitta 'receive_messages' [..] sifatida yuboriladi: paket bir marta
+# serializatsiya qilinadi. Xona ichidagi tartib saqlanadi; shu xonaga boshqa
+# hodisa (tahrir, o'chirish) yuborishdan oldin bufer flush qilinadi.
+class RoomBatcher:
+    def __init__(self):
+        self.buffers = {}  # xona -> [message_data, ...]
+        self.task = None
+
+    def enabled_for(self, chat_type):
+        mode = app.config['ROOM_BATCH_MODE']
+        return mode == 'all' or (mode == 'group' and chat_type == 'group')
+
+    def add(self, room, payload):
+        if self.task is None:
+            self.task = socketio.start_background_task(self._loop)
+        buffer = self.buffers.setdefault(room, [])
+        buffer.append(payload)
+        if len(buffer) >= app.config['ROOM_BATCH_SIZE']:
+            self.flush(room)
+
+    def flush(self, room):
+        buffer = self.buffers.pop(room, None)
+        if buffer:
+            socketio.emit('receive_messages', buffer, room=room)
+
+    def flush_all(self):
+        for room in list(self.buffers):
+            self.flush(room)
+
+    def _loop(self):
+        while True:
+            time.sleep(app.config['ROOM_BATCH_DELAY'])
+            try:
+                self.flush_all()
+            except Exception:
+                log.exception("ROOM_BATCH_ERROR")
+
+room_batcher = RoomBatcher()
+atexit.register(room_batcher.flush_all)
 
 @socketio.on('send_message')
 def handle_send(data):
-    sender = data.get('sender')
+    sender = acting_username(data.get('sender'))
     receiver = data.get('receiver')
     content = data.get('content')
     chat_type = data.get('chat_type', 'private') # 'private' yoki 'group'
 
     if not sender or not receiver or not content: return
 
-    # 1. Bazaga saqlash
-    new_msg = Message(
-        sender=sender,
-        receiver=receiver,
-        content=content,
-        msg_type=data.get('type', 'text'),
-        timestamp=datetime.utcnow()
-    )
-    db.session.add(new_msg)
-    db.session.commit()
+    # Qabul qiluvchi yuboruvchini bloklagan bo'lsa, xabar saqlanmaydi
+    if chat_type == 'private' and user_is_blocked_by(receiver, sender):
+        emit('message_failed', {'client_id': data.get('client_id'), 'reason': 'blocked'}, to=request.sid)
+        return
 
-    message_data = {
-        'id': new_msg.id,
+    item = {
         'sender': sender,
         'receiver': receiver,
         'content': content,
-        'type': new_msg.msg_type,
-        'timestamp': new_msg.timestamp.strftime('%H:%M')
+        'type': data.get('type', 'text'),
+        'chat_type': chat_type,
+        'timestamp': datetime.utcnow(),
+        'sid': request.sid,
+        'client_id': data.get('client_id')
     }
-
-    # 2. To'g'ri xonaga yuborish
-    if chat_type == 'group':
-        # Guruhlarda xona nomi guruhning nomi bilan bir xil
-        emit('receive_message', message_data, room=receiver)
+    if app.config['MESSAGE_WRITE_MODE'] == 'sync':
+        write_messages([item])
     else:
-        # Shaxsiy chatda xona nomi: user1_user2
-        room = '_'.join(sorted([sender, receiver]))
-        emit('receive_message', message_data, room=room)
+        enqueue_message(item)
 
 @socketio.on('edit_message')
 def handle_edit(data):
+    sender = acting_username(data.get('sender'))
     msg = Message.query.get(data['id'])
-    if msg and msg.sender == data.get('sender'):
+    if msg and sender and msg.sender == sender:
+        old_content = msg.content
         msg.content = data['content']
+        Conversation.query.filter_by(last_message_id=msg.id).update(
+            {'last_message': msg.content}, synchronize_session=False)
+        reindex_message(msg, old_content)
         db.session.commit()
-        room = msg.receiver if msg.chat_type == 'group' else '_'.join(sorted([msg.sender, msg.receiver]))
-        emit('message_edited', data, room=room)
-        print(f"Xabar tahrirlandi: {room}")
+        is_group = Entity.query.filter_by(name=msg.receiver).first() is not None
+        room = msg.receiver if is_group else '_'.join(sorted([msg.sender, msg.receiver]))
+        room_batcher.flush(room)
+        emit('message_edited', dict(data, sender=sender), room=room)
+        hot_log.info("Xabar tahrirlandi: %s", room)
 
 @socketio.on('delete_message')
 def handle_delete(data):
@@ -760,18 +2880,24 @@ def handle_delete(data):
         msg = Message.query.get(data['id'])
         if msg:
             r, s = msg.receiver, msg.sender
+            retire_conversation_message(msg)
+            unindex_messages(Message.id == msg.id)
             db.session.delete(msg)
             db.session.commit()
+            admin_stats.add('messages', -1)
+            # Xabarning o'zi hali buferda bo'lsa, o'chirishdan oldin yetib borsin
+            room_batcher.flush(r)
+            room_batcher.flush('_'.join(sorted([s, r])))
             emit('message_deleted', data['id'], to=r)
             emit('message_deleted', data['id'], to=s)
-    except Exception as e:
-        print(f"DELETE_ERROR: {e}")
+    except Exception:
+        log.exception("DELETE_ERROR")
 
 @socketio.on('create_entity')
 def create_entity_socket(data):
     name = data.get('name')
     etype = data.get('type')
-    username = data.get('creator')  # yoki data.get('username')
+    username = acting_username(data.get('creator'))  # yoki data.get('username')
 
     if not name or not etype or not username:
         emit('entity_error', {"message": "Barcha maydonlar to‘ldirilishi shart"}, to=request.sid)
@@ -789,6 +2915,7 @@ def create_entity_socket(data):
         )
         db.session.add(new_entity)
         db.session.flush()
+        index_entity(new_entity)
 
         member = EntityMember(
             entity_id=new_entity.id,
@@ -796,7 +2923,12 @@ def create_entity_socket(data):
             role='admin'
         )
         db.session.add(member)
+        open_group_conversation(username, name)
         db.session.commit()
+        entity_directory.invalidate()
+        room_cache.invalidate(username)
+        if etype == 'group':
+            admin_stats.add('groups', 1)
 
         emit('entity_created', {
             "name": name,
@@ -813,11 +2945,12 @@ def create_entity_socket(data):
 def handle_add_member(data):
     group = Entity.query.filter_by(name=data['group']).first()
     if group:
-        members = group.members.split(',') if group.members else []
-        if data['username'] not in members:
-            members.append(data['username'])
-            group.members = ",".join(members)
+        if not EntityMember.query.filter_by(entity_id=group.id, username=data['username']).first():
+            db.session.add(EntityMember(entity_id=group.id, username=data['username'], role='member'))
+            open_group_conversation(data['username'], group.name)
             db.session.commit()
+            entity_directory.invalidate()
+            room_cache.invalidate(data['username'])
             join_room(data['group'])
             emit('member_added', data, to=data['group'])
 
@@ -826,44 +2959,33 @@ def handle_call(data):
     emit('incoming_call', data, to=data['to'])
 
 @socketio.on('disconnect')
-def handle_disconnect():
-    print("Foydalanuvchi tarmoqdan uzildi")
+def handle_disconnect(reason=None):
+    presence.disconnect(request.sid)
+    socket_sessions.pop(request.sid, None)
+    hot_log.info("Foydalanuvchi tarmoqdan uzildi: %s (%s)", request.sid, reason)
 
 # Faol chatlar ro'yxatini olish uchun API
 @app.route('/api/my-chats')
 def get_my_chats():
-    username = request.args.get('username')
+    username = acting_username(request.args.get('username'))
     if not username: return jsonify([])
 
-    # Foydalanuvchi yozishgan barcha kontaktlarni topish
-    sent = db.session.query(Message.receiver).filter(Message.sender == username).distinct().all()
-    received = db.session.query(Message.sender).filter(Message.receiver == username).distinct().all()
-    
-    contacts = list(set([u[0] for u in sent] + [u[0] for u in received]))
-    
-    result = []
-    for contact in contacts:
-        # Oxirgi xabarni olish
-        last_msg = Message.query.filter(
-            ((Message.sender == username) & (Message.receiver == contact)) |
-            ((Message.sender == contact) & (Message.receiver == username))
-        ).order_by(Message.timestamp.desc()).first()
-        
-        result.append({
-            "username": contact,
-            "last_message": last_msg.content if last_msg else "",
-            "time": last_msg.timestamp.strftime('%H:%M') if last_msg else ""
-        })
-    
-    return jsonify(result)
+    convs = Conversation.query.filter_by(owner=username).order_by(Conversation.last_time.desc()).all()
+    return jsonify([{
+        "username": c.peer,
+        "last_message": c.last_message or "",
+        "time": c.last_time.strftime('%H:%M') if c.last_time else "",
+        "unread_count": c.unread_count or 0
+    } for c in convs])
 
 @app.route('/api/search', methods=['GET'])
 def search_entities():
     query = request.args.get('q', '').strip().lower()
     if not query:
         return jsonify([])
+    offset = max(request.args.get('offset', 0, type=int), 0)
     results = []
-    users = User.query.filter(User.username.ilike(f'%{query}%')).limit(10).all()
+    users = search_users_ranked(query, 10, offset)
     for u in users:
         results.append({
             "display_name": u.username,
@@ -871,13 +2993,15 @@ def search_entities():
             "type": "user",
             "avatar_name": u.username
         })
-    entities = Entity.query.filter(Entity.name.ilike(f'%{query}%')).limit(10).all()
+    entities = search_entities_ranked(query, 10, offset)
+    counts = dict(db.session.query(EntityMember.entity_id, db.func.count(EntityMember.id))
+                  .filter(EntityMember.entity_id.in_([e.id for e in entities]))
+                  .group_by(EntityMember.entity_id).all()) if entities else {}
     for e in entities:
-        m_count = len(e.members.split(',')) if e.members else 0
         results.append({
             "display_name": e.name,
-            "subtext": f"{m_count} a'zolar",
-            "type": e.entity_type,
+            "subtext": f"{counts.get(e.id, 0)} a'zolar",
+            "type": e.type,
             "avatar_name": e.name
         })
     return jsonify(results)
@@ -885,41 +3009,39 @@ def search_entities():
 @app.route('/api/delete_entity', methods=['POST'])
 def delete_entity():
     data = request.json
-    username = data.get('username')
+    username = acting_username(data.get('username'))
+    if not username:
+        return jsonify({"success": False, "message": "Foydalanuvchi ko'rsatilmadi"}), 400
     target = data.get('target')
     target_type = data.get('type')
     
     try:
         if target_type == 'chat':
-            Message.query.filter(
-                ((Message.sender == username) & (Message.receiver == target)) |
-                ((Message.sender == target) & (Message.receiver == username))
-            ).delete()
-            db.session.commit()
-            print(f"Chat o'chirildi: {username} va {target}")  # Log qo'shildi
-            return jsonify({"success": True, "message": "Chat o'chirildi"})
+            job = schedule_chat_deletion(username, target)
+            log.info("Chat o'chirildi: %s va %s", username, target)
+            return jsonify({"success": True, "message": "Chat o'chirildi", "job_id": job.id})
         
         elif target_type == 'group':
             entity = Entity.query.filter_by(name=target).first()
             if entity:
-                members = entity.members.split(',')
-                if username in members:
-                    members.remove(username)
-                    entity.members = ",".join(members)
+                if EntityMember.query.filter_by(entity_id=entity.id, username=username).delete():
+                    close_group_conversation(username, entity.name)
                     db.session.commit()
-                    print(f"Guruhdan chiqildi: {username} {target}dan")  # Log qo'shildi
+                    entity_directory.invalidate()
+                    room_cache.invalidate(username)
+                    log.info("Guruhdan chiqildi: %s %sdan", username, target)
                     return jsonify({"success": True, "message": "Guruhdan chiqdingiz"})
             return jsonify({"success": False, "message": "Guruh topilmadi"}), 404
     
     except Exception as e:
         db.session.rollback()
-        print(f"Delete xatosi: {e}")  # Log qo'shildi
+        log.exception("Delete xatosi")
         return jsonify({"success": False, "message": str(e)}), 500
 
 
 @socketio.on('update_user_profile')
 def handle_profile_update(data):
-    username = data.get('username')
+    username = acting_username(data.get('username'))
     new_name = data.get('name')
     new_bio = data.get('bio')
     user = User.query.filter_by(username=username).first()
@@ -927,6 +3049,7 @@ def handle_profile_update(data):
         # Username o'zgarmasligi uchun faqat bio yangilanadi
         # Agar username o'zgartirish kerak bo'lsa, alohida endpoint ishlatiladi
         user.bio = new_bio
+        index_user(user)
         db.session.commit()
         emit('profile_updated_success', {
             "name": user.username,  # username o'zgarmaydi
@@ -938,17 +3061,93 @@ def handle_profile_update(data):
 POSTS_FOLDER = os.path.join('uploads', 'posts')
 os.makedirs(POSTS_FOLDER, exist_ok=True)
 
-# app.py ichiga qo'shing
+# --- KO'RISHLAR HISOBLAGICHI ---
+# Har bir ko'rish bazaga alohida yozilmaydi: deltalar xotiradagi shardlarda
+# yig'iladi va har VIEW_FLUSH_INTERVAL da atomik
+# UPDATE post SET views = views + n bilan saqlanadi. 'update_views' ham
+# har bir post uchun bir oraliqda ko'pi bilan bir marta yuboriladi.
+class ViewCounter:
+    def __init__(self, shards=16):
+        self.shards = [({}, threading.Lock()) for _ in range(shards)]
+        self.totals = {}  # post_id -> bazadagi oxirgi ma'lum qiymat
+
+    def add(self, post_id, n=1):
+        pending, lock = self.shards[post_id % len(self.shards)]
+        with lock:
+            pending[post_id] = pending.get(post_id, 0) + n
+
+    def pending(self, post_id):
+        return self.shards[post_id % len(self.shards)][0].get(post_id, 0)
+
+    def current(self, post_id, stored=None):
+        """Bazadagi qiymat + hali yozilmagan delta"""
+        base = self.totals.get(post_id, stored or 0)
+        return base + self.pending(post_id)
+
+    def drain(self):
+        deltas = {}
+        for i, (pending, lock) in enumerate(self.shards):
+            with lock:
+                self.shards[i] = ({}, lock)
+            deltas.update(pending)
+        return deltas
+
+    def restore(self, deltas):
+        """Saqlanmay qolgan deltalarni keyingi flush uchun qaytarish"""
+        for post_id, n in deltas.items():
+            self.add(post_id, n)
+
+    def forget(self, post_id):
+        self.totals.pop(post_id, None)
+
+view_counter = ViewCounter()
+_view_flush_task = None
+
+def flush_views():
+    deltas = view_counter.drain()
+    if not deltas:
+        return
+    posts = Post.__table__
+    with app.app_context():
+        try:
+            db.session.execute(
+                db.update(posts).where(posts.c.id == db.bindparam('post_id'))
+                .values(views=db.func.coalesce(posts.c.views, 0) + db.bindparam('delta')),
+                [{'post_id': pid, 'delta': n} for pid, n in deltas.items()]
+            )
+            db.session.commit()
+        except Exception:
+            # Masalan "database is locked": ko'rishlar yo'qolmaydi, keyingi flush da yoziladi
+            db.session.rollback()
+            view_counter.restore(deltas)
+            raise
+        totals = dict(db.session.query(Post.id, Post.views).filter(Post.id.in_(list(deltas))))
+    view_counter.totals.update(totals)
+    for post_id, views in totals.items():
+        socketio.emit('update_views', {'post_id': post_id, 'views': view_counter.current(post_id)})
+
+def _view_flush_loop():
+    while True:
+        time.sleep(app.config['VIEW_FLUSH_INTERVAL'])
+        try:
+            flush_views()
+        except Exception:
+            log.exception("VIEW_FLUSH_ERROR")
+
+atexit.register(flush_views)
+
 @app.route('/api/news/view/<int:post_id>', methods=['POST'])
 def update_post_view(post_id):
-    post = Post.query.get(post_id)
-    if post:
-        post.views += 1
-        db.session.commit()
-        # Barcha foydalanuvchilarga yangi ko'rishlar sonini yuborish
-        socketio.emit('update_views', {'post_id': post_id, 'views': post.views})
-        return jsonify({"status": "success", "new_views": post.views})
-    return jsonify({"status": "error"}), 404
+    global _view_flush_task
+    if post_id not in view_counter.totals:
+        post = Post.query.get(post_id)
+        if not post:
+            return jsonify({"status": "error"}), 404
+        view_counter.totals[post_id] = post.views or 0
+    view_counter.add(post_id)
+    if _view_flush_task is None:
+        _view_flush_task = socketio.start_background_task(_view_flush_loop)
+    return jsonify({"status": "success", "new_views": view_counter.current(post_id)})
 
 # Modelni yangilash
 class Post(db.Model):
@@ -959,33 +3158,532 @@ class Post(db.Model):
     post_type = db.Column(db.String(50)) # 'video', 'image', 'reels', 'audio'
     views = db.Column(db.Integer, default=0) # KO'RISHLAR SONI
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-@app.route('/api/news-feed')
-def get_news_feed():
-    posts = Post.query.order_by(Post.created_at.desc()).all()
-    output = []
-    for post in posts:
-        output.append({
+    author = db.Column(db.String(100), nullable=True)  # username
+
+    __table_args__ = (
+        # News feed kursori: (created_at, id) bo'yicha kamayish tartibida
+        db.Index('ix_post_created_id', 'created_at', 'id'),
+        # Muallifning postlari (reconcile_counters, foydalanuvchini o'chirish)
+        db.Index('ix_post_author', 'author'),
+    )
+
+@app.route('/api/admin/add_post', methods=['POST'])
+def add_post():
+    data = request.json
+    if data.get('admin') != 'admin':
+        return jsonify({"message": "Ruxsat yo'q"}), 403
+    author = None
+    if data.get('username'):
+        author = User.query.filter_by(username=data['username']).first()
+    elif data.get('admin_phone'):
+        author = User.query.filter_by(phone=data['admin_phone']).first()
+    else:
+        author = User.query.filter_by(username=data['admin']).first()
+    if not author:
+        return jsonify({"message": "Ruxsat yo'q"}), 403
+
+    media = data.get('media') or []
+    post = Post(
+        title=data.get('title'),
+        description=data.get('description'),
+        media_urls=[m.strip() for m in media if m and m.strip()],
+        post_type=data.get('type'),
+        author=author.username
+    )
+    db.session.add(post)
+    User.query.filter_by(id=author.id).update(
+        {'posts_count': db.func.coalesce(User.posts_count, 0) + 1}, synchronize_session=False)
+    db.session.commit()
+    feed_cache.invalidate()
+    return jsonify({"status": "success", "id": post.id}), 201
+
+@app.route('/api/admin/delete_post', methods=['POST'])
+def delete_post():
+    data = request.json
+    if data.get('admin') != 'admin':
+        return jsonify({"message": "Ruxsat yo'q"}), 403
+    post = Post.query.get(data.get('id'))
+    if not post:
+        return jsonify({"status": "error"}), 404
+    if post.author:
+        User.query.filter_by(username=post.author).update(
+            {'posts_count': db.func.coalesce(User.posts_count, 1) - 1}, synchronize_session=False)
+    db.session.delete(post)
+    db.session.commit()
+    view_counter.forget(post.id)
+    feed_cache.invalidate()
+    return jsonify({"status": "success"})
+
+# --- NEWS FEED (KURSOR + KESH) ---
+# Feed (created_at, id) kursori bilan sahifalanadi. Tayyor JSON sahifalar
+# xotirada saqlanadi va post qo'shilganda/o'chirilganda yoki ko'rishlar
+# soni saqlanganda (flush_views) bekor qilinadi.
+def encode_feed_cursor(post):
+    return f"{post.created_at.isoformat()}_{post.id}"
+
+def decode_feed_cursor(cursor):
+    created_at, post_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(created_at), int(post_id)
+
+def fetch_feed_page(cursor, limit):
+    q = Post.query
+    if cursor:
+        created_at, post_id = decode_feed_cursor(cursor)
+        q = q.filter(db.tuple_(Post.created_at, Post.id) < (created_at, post_id))
+    posts = q.order_by(Post.created_at.desc(), Post.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_feed_cursor(posts[limit - 1]) if len(posts) > limit else None
+    return posts[:limit], next_cursor
+
+class FeedCache:
+    """Sahifalar ko'rishlar sonisiz saqlanadi (ETag ham shundan): ko'rishlar har
+    flush da o'zgaradi va keshni bekor qilmasligi kerak. Ular javob qurilayotganda
+    view_counter dan qo'shiladi"""
+    def __init__(self, max_pages=8):
+        self.version = 0
+        self.max_pages = max_pages
+        self.pages = OrderedDict()  # (cursor, limit) -> (version, items, etag, last_modified, next_cursor)
+
+    def invalidate(self):
+        self.version += 1
+        self.pages.clear()
+
+    def get(self, cursor, limit):
+        key = (cursor, limit)
+        entry = self.pages.get(key)
+        if entry and entry[0] == self.version:
+            self.pages.move_to_end(key)
+            return entry
+        version = self.version
+        posts, next_cursor = fetch_feed_page(cursor, limit)
+        items = [({
             "id": post.id,
             "type": post.post_type,
             "title": post.title,
             "description": post.description,
             "media": post.media_urls,
-        })
-    return jsonify(output)
+        }, post.views or 0) for post in posts]
+        body = app.json.dumps([item for item, _ in items])
+        entry = (version, items, hashlib.sha1(body.encode()).hexdigest(),
+                 datetime.now(timezone.utc).replace(microsecond=0), next_cursor)
+        if version == self.version:
+            self.pages[key] = entry
+            while len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+        return entry
+
+feed_cache = FeedCache()
+
+@app.route('/api/news-feed')
+def get_news_feed():
+    cursor = request.args.get('cursor') or None
+    limit = min(max(request.args.get('limit', app.config['FEED_PAGE_SIZE'], type=int), 1), 50)
+    try:
+        _, items, etag, last_modified, next_cursor = feed_cache.get(cursor, limit)
+    except ValueError:
+        return jsonify({"message": "Noto'g'ri cursor"}), 400
+    # Hali bazaga yozilmagan ko'rishlar ham qo'shiladi
+    body = app.json.dumps([dict(item, views=view_counter.current(item["id"], stored))
+                           for item, stored in items])
+    resp = conditional_response(body, etag, last_modified=last_modified)
+    # Keyingi sahifa: /api/news-feed?cursor=<X-Next-Cursor>
+    if next_cursor:
+        resp.headers['X-Next-Cursor'] = next_cursor
+    return resp
 
 @app.route('/api/logout', methods=['POST'])
 def logout_api():
-    data = request.json
-    username = data.get('username')
-    if username:
-        user = User.query.filter_by(username=username).first()
-        if user:
-            user.is_online = False
-            db.session.commit()
-            socketio.emit('user_disconnected', {'username': username}, broadcast=True)
+    token_hash = request_token_hash()
+    if token_hash:
+        # Faqat shu tokenga bog'langan socketlar oflayn bo'ladi: boshqa qurilmalar
+        # onlayn qoladi. Obunachilar keyingi flush_presence da xabardor qilinadi
+        for sid in [sid for sid, bound in socket_sessions.items() if bound == token_hash]:
+            presence.disconnect(sid)
+        revoke_session(token_hash)
+        db.session.commit()
     return jsonify({"success": True})
 
+# --- FONDA O'CHIRISH (TOMBSTONE + TO'PLAMLAR) ---
+# Chat yoki foydalanuvchini o'chirish so'rovi faqat arzon qismni bajaradi
+# (suhbat qatorlari yoki user qatori) va DeletionJob yozadi. Vazifa
+# tugaguncha u tombstone: get_messages max_message_id gacha bo'lgan
+# xabarlarni ko'rsatmaydi. Fon vazifasi qolganini bosqichma-bosqich
+# DELETE_BATCH_SIZE lik tranzaksiyalarda o'chiradi va har biridan keyin
+# DELETE_BATCH_PAUSE kutadi, shu orada send_message yozish qulfini oladi.
+# Jarayon 'deletion_progress' / 'deletion_done' bilan so'rovchining
+# xonasiga va /api/deletions/<id> orqali kuzatiladi.
+DELETION_STEPS = {
+    'chat': ['messages'],
+    'user': ['conversations', 'messages', 'follows', 'memberships', 'blocks', 'posts', 'uploads', 'files'],
+}
+_deletion_task = None
+
+def deletion_cutoff(u1, u2):
+    """u1-u2 shaxsiy tarixidan yashirilishi kerak bo'lgan oxirgi xabar id si"""
+    pair = ((DeletionJob.target == u1) & (DeletionJob.peer == u2)) | \
+           ((DeletionJob.target == u2) & (DeletionJob.peer == u1))
+    return db.session.query(db.func.max(DeletionJob.max_message_id)).filter(
+        DeletionJob.target.in_([u1, u2]),
+        DeletionJob.status != 'done',
+        ((DeletionJob.kind == 'chat') & pair) |
+        ((DeletionJob.kind == 'user') & DeletionJob.target.in_([u1, u2]))
+    ).scalar()
+
+def _new_deletion_job(**fields):
+    job = DeletionJob(max_message_id=db.session.query(db.func.max(Message.id)).scalar() or 0, **fields)
+    db.session.add(job)
+    return job
+
+def schedule_chat_deletion(me, other):
+    job = _new_deletion_job(kind='chat', target=me, peer=other, requested_by=me)
+    drop_private_conversation(me, other)
+    db.session.commit()
+    ensure_deletion_worker()
+    return job
+
+def schedule_user_deletion(user, requested_by):
+    avatars = [url for url in (user.avatar, user.avatar_thumb) if url and url.startswith('/uploads/cas/')]
+    job = _new_deletion_job(kind='user', target=user.username, target_id=user.id,
+                            files=json.dumps(avatars), requested_by=requested_by)
+    # Foydalanuvchi darhol yo'qoladi: login, profil va qidiruvda ko'rinmaydi
+    revoke_sessions(user.id)
+    unindex_user(user.id)
+    db.session.delete(user)
+    db.session.commit()
+    admin_stats.add('total', -1)
+    presence.drop_user(user.username)
+    ensure_deletion_worker()
+    return job
+
+def _job_message_filter(job):
+    if job.kind == 'chat':
+        cond = private_pair_filter(job.target, job.peer)
+    else:
+        cond = (Message.sender == job.target) | (Message.receiver == job.target)
+    return cond & (Message.id <= job.max_message_id)
+
+def _take_ids(column, cond, limit):
+    return [i for (i,) in db.session.query(column).filter(cond).limit(limit)]
+
+def _purge_messages(job, limit):
+    ids = _take_ids(Message.id, _job_message_filter(job), limit)
+    if ids:
+        unindex_messages(Message.id.in_(ids))
+        Message.query.filter(Message.id.in_(ids)).delete(synchronize_session=False)
+        admin_stats.add('messages', -len(ids))
+    return len(ids)
+
+def _purge_conversations(job, limit):
+    ids = _take_ids(Conversation.id, (Conversation.owner == job.target) | (Conversation.peer == job.target), limit)
+    if ids:
+        Conversation.query.filter(Conversation.id.in_(ids)).delete(synchronize_session=False)
+    return len(ids)
+
+def _purge_follows(job, limit):
+    rows = db.session.query(Follow.id, Follow.follower_id, Follow.following_id).filter(
+        (Follow.follower_id == job.target_id) | (Follow.following_id == job.target_id)).limit(limit).all()
+    if not rows:
+        return 0
+    # Qolgan tomonning hisoblagichi kamayadi
+    users = User.__table__
+    lost_followers = [{'uid': f} for _, u, f in rows if u == job.target_id and f != job.target_id]
+    lost_following = [{'uid': u} for _, u, f in rows if f == job.target_id and u != job.target_id]
+    if lost_followers:
+        db.session.execute(db.update(users).where(users.c.id == db.bindparam('uid')).values(
+            followers_count=db.func.coalesce(users.c.followers_count, 0) - 1), lost_followers)
+    if lost_following:
+        db.session.execute(db.update(users).where(users.c.id == db.bindparam('uid')).values(
+            following_count=db.func.coalesce(users.c.following_count, 0) - 1), lost_following)
+    Follow.query.filter(Follow.id.in_([r[0] for r in rows])).delete(synchronize_session=False)
+    return len(rows)
+
+def _purge_memberships(job, limit):
+    ids = _take_ids(EntityMember.id, EntityMember.username == job.target, limit)
+    if ids:
+        EntityMember.query.filter(EntityMember.id.in_(ids)).delete(synchronize_session=False)
+        entity_directory.invalidate()
+    room_cache.invalidate(job.target)
+    return len(ids)
+
+def _purge_blocks(job, limit):
+    rows = db.session.query(Block.id, Block.blocker).filter(
+        (Block.blocker == job.target) | (Block.blocked == job.target)).limit(limit).all()
+    if rows:
+        Block.query.filter(Block.id.in_([r[0] for r in rows])).delete(synchronize_session=False)
+        for _, blocker in rows:
+            block_cache.invalidate(blocker)
+    return len(rows)
+
+def _purge_posts(job, limit):
+    ids = _take_ids(Post.id, Post.author == job.target, limit)
+    if ids:
+        Post.query.filter(Post.id.in_(ids)).delete(synchronize_session=False)
+        for post_id in ids:
+            view_counter.forget(post_id)
+        feed_cache.invalidate()
+    return len(ids)
+
+def _purge_uploads(job, limit):
+    ids = _take_ids(UploadSession.id, UploadSession.username == job.target, limit)
+    for upload_id in ids:
+        if os.path.exists(upload_part_path(upload_id)):
+            os.remove(upload_part_path(upload_id))
+    if ids:
+        UploadSession.query.filter(UploadSession.id.in_(ids)).delete(synchronize_session=False)
+    return len(ids)
+
+def stored_file_in_use(url):
+    """Fayl kontent bo'yicha bitta nusxada saqlanadi: bir xil baytlar avatar,
+    chatdagi media (jumladan forward) yoki post sifatida ham ishlatilgan bo'lishi mumkin"""
+    rel_path = url[len('/uploads/'):]
+    return bool(
+        User.query.filter((User.avatar == url) | (User.avatar_thumb == url)).first()
+        or Message.query.filter(Message.content.contains(rel_path, autoescape=True)).first()
+        or Post.query.filter(db.cast(Post.media_urls, db.Text).contains(rel_path, autoescape=True)).first()
+    )
+
+def _purge_files(job, limit):
+    """Avatar fayllari: boshqa hech narsa ishlatmasa ombordan o'chiriladi"""
+    urls = json.loads(job.files or '[]')
+    job.files = None
+    removed = 0
+    for url in urls:
+        if stored_file_in_use(url):
+            continue
+        rel_path = url[len('/uploads/'):]
+        stored = StoredFile.query.filter_by(path=rel_path).first()
+        if stored:
+            db.session.delete(stored)
+            path = os.path.join(app.config['UPLOAD_FOLDER'], rel_path)
+            if os.path.exists(path):
+                os.remove(path)
+            removed += 1
+    return removed
+
+PURGE_STEPS = {
+    'messages': _purge_messages,
+    'conversations': _purge_conversations,
+    'follows': _purge_follows,
+    'memberships': _purge_memberships,
+    'blocks': _purge_blocks,
+    'posts': _purge_posts,
+    'uploads': _purge_uploads,
+    'files': _purge_files,
+}
+
+def _count_job_rows(job):
+    counts = {
+        'messages': lambda: Message.query.filter(_job_message_filter(job)).count(),
+        'conversations': lambda: Conversation.query.filter(
+            (Conversation.owner == job.target) | (Conversation.peer == job.target)).count(),
+        'follows': lambda: Follow.query.filter(
+            (Follow.follower_id == job.target_id) | (Follow.following_id == job.target_id)).count(),
+        'memberships': lambda: EntityMember.query.filter_by(username=job.target).count(),
+        'blocks': lambda: Block.query.filter((Block.blocker == job.target) | (Block.blocked == job.target)).count(),
+        'posts': lambda: Post.query.filter_by(author=job.target).count(),
+        'uploads': lambda: UploadSession.query.filter_by(username=job.target).count(),
+        'files': lambda: len(json.loads(job.files or '[]')),
+    }
+    return sum(counts[step]() for step in DELETION_STEPS[job.kind])
+
+def deletion_progress(job):
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "target": job.target,
+        "status": job.status,
+        "step": job.step,
+        "deleted": job.deleted or 0,
+        "total": job.total
+    }
+
+def prune_deletion_jobs():
+    """DELETE_JOB_RETENTION dan oldin tugagan vazifalarni o'chirish"""
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['DELETE_JOB_RETENTION'])
+    DeletionJob.query.filter(DeletionJob.status == 'done', DeletionJob.finished_at < cutoff) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+
+def _claim_deletion_job():
+    """Navbatdagi vazifani shartli UPDATE bilan olish (bir nechta worker bo'lsa ham bitta oladi)"""
+    stale = datetime.utcnow() - timedelta(seconds=app.config['DELETE_JOB_STALE'])
+    candidates = db.session.query(DeletionJob.id).filter(
+        (DeletionJob.status == 'pending') |
+        ((DeletionJob.status == 'running') & (DeletionJob.updated_at < stale))
+    ).order_by(DeletionJob.id).all()
+    for (job_id,) in candidates:
+        claimed = DeletionJob.query.filter(
+            DeletionJob.id == job_id, DeletionJob.status.in_(['pending', 'running']),
+            (DeletionJob.status == 'pending') | (DeletionJob.updated_at < stale)
+        ).update({'status': 'running', 'updated_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return DeletionJob.query.get(job_id)
+    return None
+
+def run_deletion_job(job):
+    steps = DELETION_STEPS[job.kind]
+    if job.total is None:
+        job.total = _count_job_rows(job)
+    if job.step is None:
+        job.step = steps[0]
+    db.session.commit()
+    limit = app.config['DELETE_BATCH_SIZE']
+    while job.step:
+        removed = PURGE_STEPS[job.step](job, limit)
+        job.deleted = (job.deleted or 0) + removed
+        job.updated_at = datetime.utcnow()
+        if removed < limit or job.step == 'files':
+            index = steps.index(job.step) + 1
+            job.step = steps[index] if index < len(steps) else None
+        db.session.commit()
+        if job.requested_by:
+            socketio.emit('deletion_progress', deletion_progress(job), room=job.requested_by)
+        time.sleep(app.config['DELETE_BATCH_PAUSE'])
+    job.status = 'done'
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    if job.requested_by:
+        socketio.emit('deletion_done', deletion_progress(job), room=job.requested_by)
+
+def _deletion_worker():
+    global _deletion_task
+    with app.app_context():
+        try:
+            while True:
+                job = _claim_deletion_job()
+                if job is None:
+                    prune_deletion_jobs()
+                    break
+                try:
+                    run_deletion_job(job)
+                except Exception:
+                    db.session.rollback()
+                    log.exception("DELETION_ERROR (job %s)", job.id)
+                    DeletionJob.query.filter_by(id=job.id).update({'status': 'failed'}, synchronize_session=False)
+                    db.session.commit()
+        finally:
+            _deletion_task = None
+
+def ensure_deletion_worker():
+    global _deletion_task
+    if _deletion_task is None:
+        _deletion_task = socketio.start_background_task(_deletion_worker)
+
+@app.route('/api/deletions/<int:job_id>')
+def get_deletion(job_id):
+    job = DeletionJob.query.get(job_id)
+    if not job:
+        return jsonify({"message": "Vazifa topilmadi"}), 404
+    return jsonify(deletion_progress(job))
+
+# --- BAZA MIGRATSIYALARI ---
+# db.create_all() faqat yangi jadvallarni yaratadi, mavjud jadvallarga indeks
+# yoki ustun qo'shmaydi. Shu sababli har bir sxema o'zgarishi shu yerda
+# raqamlangan qadam sifatida qo'shiladi va bir marta qo'llanadi.
+# Bir vaqtda ishga tushgan workerlar fayl qulfi orqali navbat bilan o'tadi:
+# birinchisi migratsiya qiladi, qolganlari qulf ichida SchemaVersion ni qayta
+# o'qib, qo'llangan qadamlarni o'tkazib yuboradi. Qadamlar qayta bajarilsa ham
+# xato bermaydi (IF NOT EXISTS / mavjudligini tekshirish).
+def create_model_indexes(*models):
+    with db.engine.begin() as conn:
+        for model in models:
+            for ix in model.__table__.indexes:
+                conn.execute(CreateIndex(ix, if_not_exists=True))
+
+def create_tables():
+    """db.create_all() ning IF NOT EXISTS varianti; indekslar faqat yangi jadvallarga.
+    Mavjud jadvallarning indekslari migratsiya qadamlarida (ustunlar qo'shilgandan keyin) yaratiladi"""
+    existing = set(db.inspect(db.engine).get_table_names())
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name in existing:
+                continue
+            conn.execute(CreateTable(table, if_not_exists=True))
+            for ix in table.indexes:
+                conn.execute(CreateIndex(ix, if_not_exists=True))
+
+def migration_lock_path():
+    url = db.engine.url
+    if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:':
+        return url.database + '.migrate.lock'
+    os.makedirs(app.instance_path, exist_ok=True)
+    return os.path.join(app.instance_path, 'migrations.lock')
+
+@contextlib.contextmanager
+def migration_lock():
+    if fcntl is None:
+        yield
+        return
+    with open(migration_lock_path(), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def backfill_conversations():
+    if Conversation.query.first() is None and Message.query.first() is not None:
+        rebuild_conversations()
+
+def add_missing_columns(model):
+    table = model.__table__
+    existing = {c['name'] for c in db.inspect(db.engine).get_columns(table.name)}
+    quote = db.engine.dialect.identifier_preparer.quote
+    with db.engine.begin() as conn:
+        for col in table.columns:
+            if col.name not in existing:
+                col_type = col.type.compile(dialect=db.engine.dialect)
+                conn.execute(db.text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(col.name)} {col_type}'))
+
+MIGRATIONS = [
+    (1, "message keyset indekslari", lambda: create_model_indexes(Message)),
+    (2, "conversation jadvalini to'ldirish", backfill_conversations),
+    (3, "follow/entity_member indekslari", lambda: create_model_indexes(Follow, EntityMember)),
+    (4, "user.last_seen ustuni", lambda: add_missing_columns(User)),
+    (5, "blocked_users satrini block jadvaliga ko'chirish", migrate_blocked_users_column),
+    (6, "profil hisoblagichlari", lambda: (add_missing_columns(User), add_missing_columns(Post),
+                                           reconcile_counters())),
+    (7, "entity ustunlari (type, image, theme_color)", lambda: add_missing_columns(Entity)),
+    (8, "FTS5 qidiruv indeksi", create_search_index),
+    (9, "post (created_at, id) indeksi", lambda: create_model_indexes(Post)),
+    (10, "avatar variantlari va inline avatarlarni ko'chirish",
+         lambda: (add_missing_columns(User), migrate_inline_avatars())),
+    (11, "conversation (peer, is_entity) indeksi va guruh a'zolari qatorlari",
+         lambda: (create_model_indexes(Conversation), backfill_group_conversations())),
+    (12, "post.author indeksi", lambda: create_model_indexes(Post)),
+    (13, "search_message ni tashqi kontentli FTS5 jadvalga o'tkazish", create_message_search_index),
+    (14, "deletion_job (target, status) indeksi", lambda: create_model_indexes(DeletionJob)),
+]
+
+def run_migrations():
+    with migration_lock():
+        create_tables()
+        # Qulf ichida o'qiladi: boshqa worker shu orada qo'llagan qadamlar o'tkazib yuboriladi
+        state = SchemaVersion.query.first()
+        if not state:
+            state = SchemaVersion(version=0)
+            db.session.add(state)
+            db.session.commit()
+        for version, name, step in MIGRATIONS:
+            if version <= state.version:
+                continue
+            step()
+            state.version = version
+            db.session.commit()
+            log.info("Migratsiya %s qo'llandi: %s", version, name)
+
+# Bazani yaratish (barcha modellar qo'shilgandan keyin)
+with app.app_context():
+    run_migrations()
+
+if app.config['COUNTERS_RECONCILE_INTERVAL']:
+    socketio.start_background_task(_counters_reconcile_loop)
+
+socketio.start_background_task(_hub_lag_loop)
+
+# Qayta ishga tushishdan oldin tugamay qolgan o'chirish vazifalari
+ensure_deletion_worker()
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5001))
     socketio.run(app, host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,524 @@
+"""SafeChat yuklama testi va benchmark.
+
+Vaqtinchalik SQLite bazasini sintetik ma'lumotlar bilan to'ldiradi, app.py ni
+alohida jarayonda ishga tushiradi va unga bir vaqtda Socket.IO mijozlari
+(join, send_message, typing_start; boshqa mijozlar xabarni qabul qilguncha
+o'tgan vaqt socket:deliver) hamda REST so'rovlari (/api/messages,
+/api/chats/<username>, /api/entities, /api/news-feed) yuboradi. Natija:
+har bir amal uchun p50/p95/p99 kechikish, o'tkazuvchanlik, xatolar va bitta
+REST so'roviga to'g'ri keladigan SQL so'rovlar soni. Hammasi oflayn ishlaydi.
+
+    python bench/loadtest.py                                  # standart yuklama
+    python bench/loadtest.py --messages 2000000 --clients 200 # katta baza
+    python bench/loadtest.py --scenario login-storm           # login bo'roni paytida xabar kechikishi
+    python bench/loadtest.py --server-env ROOM_BATCH_MODE=all # server sozlamasini almashtirib solishtirish
+                                                              # (xonaga yetkazish: socket:deliver qatori)
+    python bench/loadtest.py --scenario search --users 100000 --messages 10000000
+                                                              # FTS5 qidiruv; LIKE bilan solishtirish uchun
+                                                              # yana --server-env SEARCH_FTS=0 bilan
+    python bench/loadtest.py --scenario reconnect-storm --groups 500 --group-size 200
+                                                              # qayta ulanish bo'roni: connect + join kechikishi
+    python bench/loadtest.py --scenario media-seek --video-mb 1024 --http-workers 64
+                                                              # katta mp4 ustida parallel Range (seek) so'rovlari
+    python bench/loadtest.py --save-baseline                  # bench/baseline.json ni yangilash
+    python bench/loadtest.py --check                          # baseline dan yomonlashsa exit 1
+
+Qo'shimcha talablar: pip install -r bench/requirements.txt
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, 'bench', 'baseline.json')
+PASSWORD = 'bench-password'
+# Natijaga ta'sir qilmaydigan (yoki ichki) parametrlar baseline konfiguratsiyasiga kirmaydi
+NON_CONFIG_ARGS = ('mode', 'output', 'baseline', 'save_baseline', 'check', 'tolerance', 'verbose',
+                   'db', 'dataset', 'port')
+
+
+# --- SERVER TOMONI (alohida jarayonda, app.py ni import qiladi) ---
+def serve(args):
+    sys.path.insert(0, ROOT)
+    import app as safechat
+    from flask import g, has_request_context
+    from sqlalchemy import event
+
+    with safechat.app.app_context():
+        engine = safechat.db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count_query(*_):
+        if has_request_context():
+            g.bench_queries = g.get('bench_queries', 0) + 1
+
+    @safechat.app.after_request
+    def query_count_header(response):
+        response.headers['X-Query-Count'] = str(g.get('bench_queries', 0))
+        return response
+
+    safechat.socketio.run(safechat.app, host='127.0.0.1', port=args.port, log_output=False)
+
+
+def seed(args):
+    """Sxemani app.py migratsiyalari bilan yaratib, ma'lumotlarni to'g'ridan-to'g'ri yozish"""
+    sys.path.insert(0, ROOT)
+    import app as safechat
+
+    rnd = random.Random(args.seed)
+    users = [f"bench_user_{i}" for i in range(args.users)]
+    pw_hash = safechat.generate_password_hash(PASSWORD)
+    conn = sqlite3.connect(args.db)
+    conn.executemany(
+        'INSERT INTO user (username, password, phone, bio, is_blocked, followers_count, following_count, posts_count) '
+        'VALUES (?, ?, ?, ?, 0, 0, 0, 0)',
+        [(u, pw_hash, f"+998{i:09d}", f"bio {u}") for i, u in enumerate(users)]
+    )
+    ids = dict(conn.execute('SELECT username, id FROM user'))
+
+    follows = set()
+    for u in users:
+        for v in rnd.sample(users, min(args.follows, len(users) - 1)):
+            if v != u:
+                follows.add((ids[u], ids[v]))
+    conn.executemany('INSERT INTO follow (follower_id, following_id, created_at) VALUES (?, ?, ?)',
+                     [(a, b, datetime.utcnow()) for a, b in follows])
+
+    groups = [f"bench_group_{i}" for i in range(args.groups)]
+    members = {}
+    for name in groups:
+        conn.execute("INSERT INTO entity (name, type, creator, created_at) VALUES (?, 'group', ?, ?)",
+                     (name, users[0], datetime.utcnow()))
+        entity_id = conn.execute('SELECT id FROM entity WHERE name = ?', (name,)).fetchone()[0]
+        members[name] = rnd.sample(users, min(args.group_size, len(users)))
+        conn.executemany('INSERT INTO entity_member (entity_id, username, role) VALUES (?, ?, ?)',
+                         [(entity_id, u, 'member') for u in members[name]])
+
+    # Har bir foydalanuvchining bir nechta doimiy suhbatdoshi bor
+    partners = {u: rnd.sample(users, min(args.partners, len(users))) for u in users}
+    start = datetime.utcnow() - timedelta(days=30)
+    step = timedelta(days=30) / max(args.messages, 1)
+    chunk = []
+    for i in range(args.messages):
+        if groups and rnd.random() < 0.2:
+            group = rnd.choice(groups)
+            sender, receiver = rnd.choice(members[group]), group
+        else:
+            sender = rnd.choice(users)
+            receiver = rnd.choice(partners[sender])
+        chunk.append((sender, receiver, f"message {i} from {sender}", 'text', start + step * i))
+        if len(chunk) >= 50000:
+            conn.executemany('INSERT INTO message (sender, receiver, content, msg_type, timestamp) '
+                             'VALUES (?, ?, ?, ?, ?)', chunk)
+            chunk = []
+    if chunk:
+        conn.executemany('INSERT INTO message (sender, receiver, content, msg_type, timestamp) '
+                         'VALUES (?, ?, ?, ?, ?)', chunk)
+
+    conn.executemany('INSERT INTO post (title, description, post_type, views, created_at, author) '
+                     'VALUES (?, ?, ?, 0, ?, ?)',
+                     [(f"post {i}", "bench", 'image', start + timedelta(minutes=i), rnd.choice(users))
+                      for i in range(args.posts)])
+    conn.commit()
+    conn.close()
+
+    with safechat.app.app_context():
+        safechat.rebuild_conversations()
+        safechat.reconcile_counters()
+        safechat.create_search_index()
+    json.dump({'users': users, 'groups': members, 'partners': partners}, open(args.dataset, 'w'))
+
+
+# --- YUKLAMA TOMONI ---
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}   # amal -> [sekund]
+        self.errors = {}
+        self.queries = {}   # amal -> [so'rovlar soni]
+
+    def add(self, op, seconds, queries=None):
+        with self.lock:
+            self.samples.setdefault(op, []).append(seconds)
+            if queries is not None:
+                self.queries.setdefault(op, []).append(queries)
+
+    def error(self, op):
+        with self.lock:
+            self.errors[op] = self.errors.get(op, 0) + 1
+
+    def report(self, duration):
+        def pct(values, p):
+            return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+        results = {}
+        for op in sorted(set(self.samples) | set(self.errors)):
+            values = sorted(self.samples.get(op, []))
+            queries = self.queries.get(op)
+            results[op] = {
+                'count': len(values),
+                'errors': self.errors.get(op, 0),
+                'p50_ms': round(pct(values, 0.50), 2) if values else None,
+                'p95_ms': round(pct(values, 0.95), 2) if values else None,
+                'p99_ms': round(pct(values, 0.99), 2) if values else None,
+                'throughput_per_s': round(len(values) / duration, 1),
+                'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+            }
+        return results
+
+
+def peers_online(username, dataset):
+    """Shu mijoz bilan xabar almashadigan boshqa ulangan mijozlar (ikki tomonlama suhbatdoshlar)"""
+    online = set(dataset['clients'])
+    peers = {p for p in dataset['partners'][username] if p in online}
+    peers |= {u for u in online if username in dataset['partners'][u]}
+    peers.discard(username)
+    return sorted(peers)
+
+
+def socket_client(url, username, token, dataset, recorder, stop_at, args):
+    import socketio
+    rnd = random.Random(hash(username))
+    pending = {}
+    sio = socketio.Client(reconnection=False)
+
+    @sio.on('message_ack')
+    def on_ack(data):
+        sent_at = pending.pop(data.get('client_id'), None)
+        if sent_at is not None:
+            recorder.add('socket:send_message', time.monotonic() - sent_at)
+
+    @sio.on('message_failed')
+    def on_failed(data):
+        pending.pop(data.get('client_id'), None)
+        recorder.error('socket:send_message')
+
+    # Qabul qiluvchi tomoni: yuborilgandan shu mijozga yetib kelguncha (fan-out) vaqt.
+    # Yuborish vaqti xabar matnining oxirida; mijozlar bitta jarayonda, monotonic umumiy
+    def on_delivered(data):
+        if data.get('sender') == username:
+            return
+        try:
+            sent_at = float(str(data.get('content')).rpartition(' ')[2])
+        except ValueError:
+            return
+        recorder.add('socket:deliver', time.monotonic() - sent_at)
+
+    sio.on('receive_message', on_delivered)
+    sio.on('receive_messages', lambda batch: [on_delivered(data) for data in batch])
+
+    try:
+        sio.connect(url, auth={'token': token}, transports=['websocket'])
+        t = time.monotonic()
+        sio.call('join', {'username': username, 'token': token}, timeout=30)
+        recorder.add('socket:join', time.monotonic() - t)
+        # Shaxsiy xabarlar user1_user2 xonasiga ketadi: ulangan suhbatdoshlar bilan xonalarga kiramiz
+        for peer in peers_online(username, dataset):
+            sio.call('join_private_chat', {'user1': username, 'user2': peer}, timeout=30)
+    except Exception:
+        recorder.error('socket:join')
+        return
+
+    my_groups = [g for g, members in dataset['groups'].items() if username in members]
+    n = 0
+    while time.monotonic() < stop_at:
+        n += 1
+        try:
+            if n % 5 == 0:
+                peer = rnd.choice(dataset['partners'][username])
+                t = time.monotonic()
+                sio.call('typing_start', {'sender': username, 'receiver': peer}, timeout=30)
+                recorder.add('socket:typing_start', time.monotonic() - t)
+            if my_groups and rnd.random() < 0.2:
+                receiver, chat_type = rnd.choice(my_groups), 'group'
+            else:
+                receiver, chat_type = rnd.choice(dataset['partners'][username]), 'private'
+            client_id = f"{username}-{n}"
+            pending[client_id] = time.monotonic()
+            sio.emit('send_message', {'sender': username, 'receiver': receiver,
+                                      'content': f"load {n} {time.monotonic():.6f}",
+                                      'chat_type': chat_type, 'client_id': client_id})
+        except Exception:
+            recorder.error('socket:send_message')
+        time.sleep(args.msg_interval)
+    # Oxirgi ack larni kutish
+    deadline = time.monotonic() + 5
+    while pending and time.monotonic() < deadline:
+        time.sleep(0.05)
+    for _ in pending:
+        recorder.error('socket:send_message')
+    sio.disconnect()
+
+
+def reconnect_client(url, username, token, recorder, stop_at):
+    """Qayta ulanish bo'roni: connect + join (guruh xonalari bilan) + disconnect qayta-qayta"""
+    import socketio
+    while time.monotonic() < stop_at:
+        sio = socketio.Client(reconnection=False)
+        t = time.monotonic()
+        try:
+            sio.connect(url, auth={'token': token}, transports=['websocket'])
+            sio.call('join', {'username': username, 'token': token}, timeout=30)
+            recorder.add('socket:reconnect', time.monotonic() - t)
+        except Exception:
+            recorder.error('socket:reconnect')
+        finally:
+            sio.disconnect()
+
+
+def http_worker(base, dataset, recorder, stop_at, scenario, seed_value):
+    import requests
+    rnd = random.Random(seed_value)
+    session = requests.Session()
+    users = dataset['users']
+    while time.monotonic() < stop_at:
+        u = rnd.choice(users)
+        if scenario == 'login-storm':
+            op, req = 'POST /api/login', lambda: session.post(
+                f"{base}/api/login", json={'username': u, 'password': PASSWORD})
+        elif scenario == 'media-seek':
+            # Video pleyer seek qilgandek: faylning tasodifiy joyidan 256 KB - 1 MB oraliq
+            video = dataset['video']
+            length = rnd.randint(256 * 1024, 1024 * 1024)
+            start = rnd.randrange(0, video['size'] - length)
+            op, req = 'GET /uploads (Range)', lambda: session.get(
+                f"{base}{video['url']}", headers={'Range': f"bytes={start}-{start + length - 1}"})
+        elif scenario == 'search':
+            # Boshqa foydalanuvchi nomi: users/search va /api/search da topiladi,
+            # xabarlarda esa "message N from <username>" matnidan
+            q = rnd.choice(users)
+            choice = rnd.randrange(3)
+            if choice == 0:
+                op, req = 'GET /api/users/search', lambda: session.get(
+                    f"{base}/api/users/search", params={'q': q, 'limit': 20})
+            elif choice == 1:
+                op, req = 'GET /api/search', lambda: session.get(f"{base}/api/search", params={'q': q})
+            else:
+                op, req = 'GET /api/messages/search', lambda: session.get(
+                    f"{base}/api/messages/search", params={'username': u, 'q': q})
+        else:
+            choice = rnd.randrange(4)
+            if choice == 0:
+                v = rnd.choice(dataset['partners'][u])
+                op, req = 'GET /api/messages', lambda: session.get(
+                    f"{base}/api/messages", params={'user1': u, 'user2': v})
+            elif choice == 1:
+                op, req = 'GET /api/chats/<username>', lambda: session.get(f"{base}/api/chats/{u}")
+            elif choice == 2:
+                op, req = 'GET /api/entities', lambda: session.get(f"{base}/api/entities")
+            else:
+                op, req = 'GET /api/news-feed', lambda: session.get(f"{base}/api/news-feed")
+        t = time.monotonic()
+        try:
+            resp = req()
+        except Exception:
+            recorder.error(op)
+            continue
+        elapsed = time.monotonic() - t
+        if resp.status_code >= 400 or (scenario == 'media-seek' and resp.status_code != 206):
+            recorder.error(op)
+            continue
+        queries = resp.headers.get('X-Query-Count')
+        recorder.add(op, elapsed, int(queries) if queries is not None else None)
+
+
+def make_video(workdir, size_mb):
+    """Serverning UPLOAD_FOLDER iga katta .mp4 fayl yozish (tasodifiy baytlar, siqilmaydi)"""
+    path = os.path.join(workdir, 'uploads', 'media', 'bench.mp4')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+    return {'url': '/uploads/media/bench.mp4', 'size': size_mb * 1024 * 1024}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, proc, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("server ishga tushmadi")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server portni ochmadi")
+
+
+def compare(results, baseline, tolerance):
+    """Baseline bilan solishtirish; yomonlashgan amallar ro'yxati"""
+    regressions = []
+    print(f"\n{'amal':34} {'p95 (baseline)':>22} {'ops/s (baseline)':>24}")
+    for op, cur in results.items():
+        base = baseline.get('results', {}).get(op)
+        if not base or not cur['p95_ms'] or not base.get('p95_ms'):
+            continue
+        p95_ratio = cur['p95_ms'] / base['p95_ms']
+        tput_ratio = cur['throughput_per_s'] / base['throughput_per_s'] if base['throughput_per_s'] else 1
+        worse = p95_ratio > 1 + tolerance or tput_ratio < 1 - tolerance
+        if worse:
+            regressions.append(op)
+        print(f"{op:34} {cur['p95_ms']:>9.1f} ({base['p95_ms']:>8.1f}) {p95_ratio:>4.0%}"
+              f" {cur['throughput_per_s']:>9.1f} ({base['throughput_per_s']:>8.1f}) {tput_ratio:>4.0%}"
+              f"{'  <- REGRESSIYA' if worse else ''}")
+    return regressions
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='safechat-bench-')
+    db_path = os.path.join(workdir, 'bench.db')
+    dataset_path = os.path.join(workdir, 'dataset.json')
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", COUNTERS_RECONCILE_INTERVAL='0')
+    for item in args.server_env:
+        key, _, value = item.partition('=')
+        env[key] = value
+    script = os.path.abspath(__file__)
+    server = None
+    try:
+        t = time.monotonic()
+        subprocess.run([sys.executable, script, 'seed', '--db', db_path, '--dataset', dataset_path,
+                        '--users', str(args.users), '--follows', str(args.follows),
+                        '--groups', str(args.groups), '--group-size', str(args.group_size),
+                        '--partners', str(args.partners), '--messages', str(args.messages),
+                        '--posts', str(args.posts), '--seed', str(args.seed)],
+                       cwd=workdir, env=env, check=True, stdout=subprocess.DEVNULL)
+        print(f"baza tayyor: {args.users} user, {args.messages} xabar ({time.monotonic() - t:.1f}s)")
+        dataset = json.load(open(dataset_path))
+        if args.scenario == 'media-seek':
+            dataset['video'] = make_video(workdir, args.video_mb)
+
+        port = free_port()
+        server = subprocess.Popen([sys.executable, script, 'serve', '--port', str(port)],
+                                  cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+                                  stderr=None if args.verbose else subprocess.DEVNULL)
+        wait_for_port(port, server)
+        base = f"http://127.0.0.1:{port}"
+
+        import requests
+        clients = dataset['users'][:args.clients]
+        dataset['clients'] = clients
+        tokens = {}
+        for u in clients:
+            resp = requests.post(f"{base}/api/login", json={'username': u, 'password': PASSWORD})
+            tokens[u] = resp.json().get('token')
+
+        recorder = Recorder()
+        stop_at = time.monotonic() + args.duration
+        # reconnect-storm: mijozlarning yarmi uzilib-ulanadi, qolgani xabar yuborishda davom etadi
+        storm = clients[len(clients) // 2:] if args.scenario == 'reconnect-storm' else []
+        threads = [threading.Thread(target=socket_client,
+                                    args=(base, u, tokens[u], dataset, recorder, stop_at, args))
+                   for u in clients if u not in storm]
+        threads += [threading.Thread(target=reconnect_client, args=(base, u, tokens[u], recorder, stop_at))
+                    for u in storm]
+        threads += [threading.Thread(target=http_worker,
+                                     args=(base, dataset, recorder, stop_at, args.scenario, args.seed + i))
+                    for i in range(args.http_workers)]
+        started = time.monotonic()
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        duration = min(time.monotonic() - started, args.duration)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = recorder.report(duration)
+    report = {
+        'config': {k: v for k, v in vars(args).items() if k not in NON_CONFIG_ARGS},
+        'results': results,
+    }
+    print(f"\n{'amal':34} {'soni':>7} {'xato':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'ops/s':>8} {'sql/req':>8}")
+    for op, r in results.items():
+        fmt = lambda v: f"{v:8.1f}" if v is not None else f"{'-':>8}"
+        print(f"{op:34} {r['count']:>7} {r['errors']:>5} {fmt(r['p50_ms'])} {fmt(r['p95_ms'])} "
+              f"{fmt(r['p99_ms'])} {fmt(r['throughput_per_s'])} {fmt(r['queries_per_request'])}")
+
+    if args.output:
+        json.dump(report, open(args.output, 'w'), indent=2)
+    if args.save_baseline:
+        json.dump(report, open(args.baseline, 'w'), indent=2)
+        print(f"\nbaseline saqlandi: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        if args.check:
+            print(f"\nbaseline topilmadi: {args.baseline}")
+            return 1
+        return 0
+    baseline = json.load(open(args.baseline))
+    if baseline.get('config') != report['config']:
+        # Boshqa hajm/yuklama bilan olingan raqamlarni solishtirib bo'lmaydi
+        base_config = baseline.get('config', {})
+        differs = sorted(k for k in set(base_config) | set(report['config'])
+                         if base_config.get(k) != report['config'].get(k))
+        print(f"\nbaseline boshqa sozlamalar bilan olingan ({', '.join(differs)}), solishtirilmadi")
+        return 1 if args.check else 0
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions and args.check:
+        print(f"\n{len(regressions)} ta amal yomonlashdi")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('mode', nargs='?', default='run', choices=['run', 'seed', 'serve'])
+    data = parser.add_argument_group('sintetik ma\'lumotlar')
+    data.add_argument('--users', type=int, default=1000)
+    data.add_argument('--follows', type=int, default=20, help="har bir user nechta odamni follow qiladi")
+    data.add_argument('--groups', type=int, default=50)
+    data.add_argument('--group-size', type=int, default=40)
+    data.add_argument('--partners', type=int, default=10, help="har bir userning suhbatdoshlari soni")
+    data.add_argument('--messages', type=int, default=200000)
+    data.add_argument('--posts', type=int, default=500)
+    data.add_argument('--seed', type=int, default=1)
+    load = parser.add_argument_group('yuklama')
+    load.add_argument('--clients', type=int, default=50, help="bir vaqtdagi Socket.IO mijozlari")
+    load.add_argument('--http-workers', type=int, default=8)
+    load.add_argument('--duration', type=float, default=20, help="sekund")
+    load.add_argument('--msg-interval', type=float, default=0.05, help="har bir mijozning xabarlari orasidagi pauza")
+    load.add_argument('--scenario', choices=['mixed', 'login-storm', 'search', 'reconnect-storm', 'media-seek'], default='mixed')
+    load.add_argument('--video-mb', type=int, default=256, help="media-seek uchun video hajmi (MB)")
+    load.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE')
+    out = parser.add_argument_group('natija')
+    out.add_argument('--output', help="to'liq hisobotni JSON ga yozish")
+    out.add_argument('--baseline', default=BASELINE)
+    out.add_argument('--save-baseline', action='store_true')
+    out.add_argument('--check', action='store_true', help="yomonlashsa exit 1")
+    out.add_argument('--tolerance', type=float, default=0.25, help="ruxsat etilgan og'ish (0.25 = 25%%)")
+    out.add_argument('--verbose', action='store_true', help="server loglarini ko'rsatish")
+    # seed/serve rejimlari uchun (ichki)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    parser.add_argument('--dataset', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode == 'seed':
+        seed(args)
+    elif args.mode == 'serve':
+        serve(args)
+    else:
+        sys.exit(run(args))
+
+
+if __name__ == '__main__':
+    main()
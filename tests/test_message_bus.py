@@ -0,0 +1,105 @@
+"""Bir nechta worker: A ga ulangan mijoz yuborgan xabar B ga ulangan mijozga yetib borishi.
+
+Ikkita app.py jarayoni bitta baza va SOCKETIO_MESSAGE_QUEUE=sqlite:///... shinasi
+bilan ishga tushiriladi (tashqi servislarsiz).
+"""
+import os
+import sys
+import time
+import socket
+import threading
+import subprocess
+
+import pytest
+
+socketio = pytest.importorskip('socketio')
+requests = pytest.importorskip('requests')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, proc, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        assert proc.poll() is None, "server ishga tushmadi"
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise AssertionError("server portni ochmadi")
+
+
+@pytest.fixture
+def two_workers(tmp_path):
+    env = dict(os.environ,
+               DATABASE_URL=f"sqlite:///{tmp_path / 'app.db'}",
+               SOCKETIO_MESSAGE_QUEUE=f"sqlite:///{tmp_path / 'bus.db'}",
+               COUNTERS_RECONCILE_INTERVAL='0',
+               LOG_LEVEL='WARNING',
+               PYTHONPATH=ROOT)
+    code = ("import sys, app; "
+            "app.socketio.run(app.app, host='127.0.0.1', port=int(sys.argv[1]), log_output=False)")
+    workers = []
+    try:
+        for _ in range(2):
+            port = free_port()
+            proc = subprocess.Popen([sys.executable, '-c', code, str(port)], cwd=tmp_path, env=env,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            workers.append((proc, port))
+            wait_for_port(port, proc)
+        yield [f"http://127.0.0.1:{port}" for _, port in workers]
+    finally:
+        for proc, _ in workers:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+
+def login(base, username):
+    resp = requests.post(f"{base}/api/register",
+                         json={'username': username, 'password': 'secret', 'phone': f"+{abs(hash(username))}"})
+    assert resp.status_code == 201
+    resp = requests.post(f"{base}/api/login", json={'username': username, 'password': 'secret'})
+    return resp.json()['token']
+
+
+def connect(base, username, token):
+    client = socketio.Client(reconnection=False)
+    client.connect(base, auth={'token': token}, transports=['websocket'])
+    client.call('join', {'username': username, 'token': token}, timeout=10)
+    return client
+
+
+def test_message_reaches_client_on_other_worker(two_workers):
+    base_a, base_b = two_workers
+    alice = connect(base_a, 'alice', login(base_a, 'alice'))
+    bob = connect(base_b, 'bob', login(base_b, 'bob'))
+    received = []
+    got_it = threading.Event()
+
+    @bob.on('receive_message')
+    def on_message(data):
+        received.append(data)
+        got_it.set()
+
+    acked = threading.Event()
+    alice.on('message_ack', lambda data: acked.set())
+    try:
+        alice.call('join_private_chat', {'user1': 'alice', 'user2': 'bob', 'room': 'alice_bob'}, timeout=10)
+        bob.call('join_private_chat', {'user1': 'bob', 'user2': 'alice', 'room': 'alice_bob'}, timeout=10)
+        alice.emit('send_message', {'sender': 'alice', 'receiver': 'bob', 'content': 'salom',
+                                    'chat_type': 'private', 'client_id': 'c1'})
+
+        assert acked.wait(10), "worker A xabarni saqlamadi"
+        assert got_it.wait(10), "xabar worker B dagi mijozga yetib bormadi"
+        assert received[0]['sender'] == 'alice'
+        assert received[0]['content'] == 'salom'
+    finally:
+        alice.disconnect()
+        bob.disconnect()
@@ -0,0 +1,142 @@
+"""Issiq so'rovlar (tarix, chatlar ro'yxati, hisoblagichlar, qidiruv) indeks ishlatadimi.
+
+Har bir yo'l ishga tushirilib, bajarilgan SQL lar ushlanadi va har biri uchun
+EXPLAIN QUERY PLAN olinadi. Rejada jadvalni to'liq o'qish (SCAN) bo'lsa, test
+yiqiladi: yangi so'rov yoki olib tashlangan indeks shu yerda ko'rinadi.
+
+app import qilinganda eventlet monkey_patch qiladi, bu esa pytest jarayonidagi
+boshqa testlarning (socketio mijozlari) threadlarini buzadi. Shuning uchun
+rejalar shu faylni alohida jarayonda ishga tushirib yig'iladi.
+"""
+import os
+import sys
+import json
+import contextlib
+import subprocess
+from datetime import datetime
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Rejada SCAN bo'lsa ham to'liq o'qish emas
+ALLOWED_SCANS = ('VIRTUAL TABLE', 'CONSTANT ROW')
+
+
+def seed(m):
+    db = m.db
+    users = [m.User(username=f"u{i}", password='x', phone=f"+998{i:07d}") for i in range(50)]
+    db.session.add_all(users)
+    db.session.flush()
+    for a in users[:10]:
+        for b in users[10:20]:
+            db.session.add(m.Follow(follower_id=a.id, following_id=b.id))
+    group = m.Entity(name='guruh', type='group', creator='u0')
+    db.session.add(group)
+    db.session.flush()
+    db.session.add_all(m.EntityMember(entity_id=group.id, username=u.username) for u in users[:20])
+    db.session.add_all(m.Post(author='u1', title=f"post {i}") for i in range(5))
+    db.session.commit()
+    now = datetime.utcnow()
+    m.write_messages([{'sender': f"u{i % 2}", 'receiver': 'guruh' if i % 3 == 0 else f"u{(i + 1) % 2}",
+                       'content': f"salom dunyo {i}", 'type': 'text',
+                       'chat_type': 'group' if i % 3 == 0 else 'private',
+                       'timestamp': now, 'sid': None, 'client_id': None} for i in range(60)])
+    m.reconcile_counters()
+
+
+@contextlib.contextmanager
+def captured_statements(m):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'INSERT')):
+            statements.append((statement, parameters))
+
+    m.event.listen(m.db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        m.event.remove(m.db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def full_scans(m, statements):
+    found = []
+    with m.db.engine.connect() as conn:
+        for statement, parameters in statements:
+            for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters):
+                detail = row[-1]
+                if 'SCAN' in detail and not any(a in detail for a in ALLOWED_SCANS):
+                    found.append(f"{detail}  <-  {' '.join(statement.split())}")
+    return found
+
+
+NEW_MESSAGE = {'content': 'yangi xabar', 'type': 'text', 'timestamp': datetime.utcnow(),
+               'sid': None, 'client_id': None}
+
+
+def get(m, url):
+    resp = m.app.test_client().get(url)
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+
+
+HOT_PATHS = {
+    'history-private': lambda m: get(m, '/api/messages?user1=u0&user2=u1'),
+    'history-private-older': lambda m: get(m, '/api/messages?user1=u0&user2=u1&before_id=30&limit=10'),
+    'history-group': lambda m: get(m, '/api/messages?user1=u0&user2=guruh&before_id=40&limit=10'),
+    'chats': lambda m: get(m, '/api/chats/u0'),
+    'my-chats': lambda m: get(m, '/api/my-chats?username=u0'),
+    'recent-chats': lambda m: get(m, '/api/recent_chats?username=u0'),
+    'profile': lambda m: get(m, '/api/user/profile/u10?viewer=u0'),
+    'search-users': lambda m: get(m, '/api/users/search?q=u1'),
+    'search-entities': lambda m: get(m, '/api/search?q=guruh'),
+    'search-messages': lambda m: get(m, '/api/messages/search?username=u0&q=dunyo'),
+    'send-message': lambda m: m.write_messages([
+        dict(NEW_MESSAGE, sender='u0', receiver='u1', chat_type='private'),
+        dict(NEW_MESSAGE, sender='u0', receiver='guruh', chat_type='group')]),
+    'counters-reconcile': lambda m: m.reconcile_counters(),
+}
+
+
+
+
+def collect_scans():
+    import app as m
+    with m.app.app_context():
+        seed(m)
+        result = {}
+        for name, run in HOT_PATHS.items():
+            with captured_statements(m) as statements:
+                run(m)
+            result[name] = {'statements': len(statements), 'scans': full_scans(m, statements)}
+    return result
+
+
+@pytest.fixture(scope='module')
+def plans(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('plans')
+    env = dict(os.environ,
+               DATABASE_URL=f"sqlite:///{tmp / 'app.db'}",
+               COUNTERS_RECONCILE_INTERVAL='0',
+               MESSAGE_WRITE_MODE='sync',
+               LOG_LEVEL='WARNING',
+               PYTHONPATH=ROOT)
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__)], cwd=tmp, env=env,
+                          capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 0, proc.stderr
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+@pytest.mark.parametrize('name', sorted(HOT_PATHS))
+def test_hot_path_uses_indexes(plans, name):
+    assert plans[name]['statements']
+    scans = plans[name]['scans']
+    if name == 'counters-reconcile':
+        # Tashqi "SCAN user" UPDATE ning o'zi (har bir foydalanuvchi yangilanadi);
+        # ichki COUNT lar indeks bo'yicha bo'lishi kerak
+        scans = [s for s in scans if not s.startswith('SCAN user ')]
+    assert scans == []
+
+
+if __name__ == '__main__':
+    print(json.dumps(collect_scans()))